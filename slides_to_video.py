@@ -5,19 +5,21 @@ def load_heavy_modules():
 
     my_bar = st.progress(0, text="Cargando módulos, por favor espera...")
     global detect_file_type, get_file_stats, reset_state, init_session_state, get_language_options
-    global extract_pdf_slides, extract_pptx_slides, get_file_bytes, get_vlm
-    global get_tts_provider, Translator
-    global merge_slides_to_video
+    global load_presentation, ensure_text_layers, get_file_bytes, get_vlm, RASTER_RESOLUTIONS
+    global get_tts_provider, tts_cache_stats, Translator
+    global merge_slides_to_video, SlideStore, session_stores_over_budget
     # Loading File Utils
     my_bar.progress(10, text="Cargando FileUtils...")
     from utils.FileUtils import (
         detect_file_type, get_file_stats, reset_state, init_session_state,
-        get_language_options, extract_pdf_slides, extract_pptx_slides, get_file_bytes
+        get_language_options, load_presentation, ensure_text_layers, get_file_bytes,
+        RASTER_RESOLUTIONS
     )
+    from utils.SlideUtils import SlideStore, session_stores_over_budget
     my_bar.progress(35, text="Cargando VLMUtils...")
     from utils.VLMUtils import get_vlm
     my_bar.progress(60, text="Cargando TTSUtils...")
-    from utils.TTSUtils import get_tts_provider
+    from utils.TTSUtils import get_tts_provider, tts_cache_stats
     my_bar.progress(75, text="Cargando TranlationUtils...")
     from utils.TranlationUtils import Translator
     my_bar.progress(90, text="Cargando VideoUtils...")
@@ -27,9 +29,10 @@ def load_heavy_modules():
     my_bar.empty()
 
 
-import time
+import os
 import threading
 import queue
+from io import BytesIO
 from utils.VideoUtils import merge_slides_to_video
 
 
@@ -38,6 +41,23 @@ def step_upload():
     col1, col2 = st.columns([3, 2])
     with col1:
         st.write("#### Sube tu presentación")
+        resolution = st.selectbox(
+            "Resolución del video",
+            options=list(RASTER_RESOLUTIONS.keys()),
+            index=1,
+            help="Las diapositivas se rasterizan directamente a esta altura",
+            key="raster_resolution"
+        )
+        target_height = RASTER_RESOLUTIONS[resolution]
+        with st.expander("Opciones avanzadas"):
+            raster_workers = st.number_input(
+                "Procesos de rasterizado",
+                min_value=1,
+                value=os.cpu_count() or 1,
+                step=1,
+                help="Número de procesos que convierten páginas en imágenes a la vez",
+                key="raster_workers"
+            )
         uploaded_file = st.file_uploader(
             "Arrastra o selecciona tu archivo",
             type=['pdf', 'pptx'],
@@ -47,17 +67,26 @@ def step_upload():
         if uploaded_file:
             file_type = detect_file_type(uploaded_file)
             if file_type:
-                stats = get_file_stats(file_type, uploaded_file)
-                if stats:
-                    st.session_state.uploaded_file = uploaded_file
-                    st.session_state.file_type = file_type
-                    st.session_state.file_stats = stats
-                    st.success("✅ Archivo cargado correctamente")
-                    if file_type == 'pdf':
-                        st.session_state.slides_images = extract_pdf_slides(uploaded_file)
-                        st.session_state.slides_notes = ["" for _ in st.session_state.slides_images]
-                    else:
-                        st.session_state.slides_images, st.session_state.slides_notes = extract_pptx_slides(uploaded_file)
+                key, stats, slides_images, slides_notes = load_presentation(uploaded_file, file_type, target_height, raster_workers)
+                if stats and slides_images:
+                    # Solo se rehace el almacén si cambia la presentación o los ajustes
+                    if st.session_state.get("upload_key") != key:
+                        if st.session_state.get("slide_store"):
+                            st.session_state.slide_store.close()
+                            st.session_state.slide_store = None
+                            st.session_state.upload_key = None
+                        # Con el disco de sesiones lleno se rechaza la subida en vez de borrar sesiones activas
+                        if session_stores_over_budget():
+                            st.session_state.uploaded_file = None
+                            st.error("❌ El servidor no tiene espacio para más sesiones ahora mismo. Inténtalo de nuevo más tarde.")
+                        else:
+                            st.session_state.slide_store = SlideStore.from_slides(slides_images, slides_notes, link=True)
+                            st.session_state.upload_key = key
+                    if st.session_state.get("slide_store"):
+                        st.session_state.uploaded_file = uploaded_file
+                        st.session_state.file_type = file_type
+                        st.session_state.file_stats = stats
+                        st.success("✅ Archivo cargado correctamente")
         if st.session_state.uploaded_file and st.button("✨ Siguiente ✨", use_container_width=True):
             st.session_state.step += 1
             st.rerun()
@@ -90,7 +119,8 @@ def step_configure_notes():
     col_config, col_preview = st.columns(2)
     with col_config:
         languages = get_language_options()
-        notes = st.session_state.slides_notes  # Directamente de la sesión
+        store = st.session_state.slide_store
+        notes = store.notes()  # Directamente del almacén de la sesión
         has_notes = any(note for note in notes)
         st.write("### Selección de operación:")
         notes_mode = st.selectbox(
@@ -107,6 +137,17 @@ def step_configure_notes():
                               "ro": "ron_Latn", "it": "ita_Latn", "pt": "por_Latn", "nl": "nld_Latn",
                               "pl": "pol_Latn", "ar": "arb_Arab"}
             src_bcp47, tgt_bcp47 = language_bcp47.get(source_lang, source_lang), language_bcp47.get(target_lang, target_lang)
+            col1, col2 = st.columns([1, 1])
+            with col1:
+                st.number_input("Tamaño de lote", min_value=1, value=8, step=1, key="translation_batch_size", help="Número de frases que se traducen a la vez en cada pasada del modelo")
+            with col2:
+                st.selectbox(
+                    "Motor de traducción",
+                    options=["torch", "ctranslate2"],
+                    format_func=lambda x: "PyTorch" if x == "torch" else "CTranslate2 int8 (CPU)",
+                    key="translation_backend",
+                    help="CTranslate2 ejecuta una versión cuantizada del modelo, más rápida en CPU"
+                )
         else:
             st.write("### Generar notas")
             # Configuración de VLM para generación de notas
@@ -153,8 +194,7 @@ def step_configure_notes():
                     # Se solicita también el identificador del modelo, en el caso de Gemini no hay URL
                     model_id = st.text_input("Model Identifier", value=st.session_state.get("gemini_model_id", "gemini-2.0-flash"), key="gemini_model_id")
                 with col3:
-                    # Usar un key distinto, asignando el valor a una variable local
-                    st.number_input("Reqtime(ms)", min_value=0, value=0, step=100, key="gem_wait_time", help="Tiempo de espera entre solicitudes a la API de Gemini (en milisegundos)")
+                    st.number_input("Peticiones/min", min_value=0, value=15, step=1, key="gem_rpm", help="Límite de peticiones por minuto a la API de Gemini (0 = sin límite)")
                 with col4:
                     st.number_input("Maxtokens", min_value=1, value=500, step=1, key="max_tokens", help="Número máximo de tokens en la respuesta generada por el modelo")
 
@@ -164,78 +204,132 @@ def step_configure_notes():
                     help="Define cómo se generarán las notas",
                     height=100
                 )
+
+            st.number_input("Peticiones simultáneas", min_value=1, value=4, step=1, key="vlm_concurrency", help="Número de diapositivas que se procesan a la vez al generar todas las notas")
+            st.number_input("Diapositivas por petición", min_value=1, max_value=10, value=1, step=1, key="vlm_slides_per_request", help="Con más de una, cada petición describe varias diapositivas seguidas con el resumen de las anteriores como contexto: menos peticiones y una narración más coherente")
+            st.checkbox("Describir por su texto las diapositivas con mucho texto", value=False, key="vlm_text_tier", help="Las diapositivas cuyo texto ocupa la mayor parte del contenido se describen con una petición solo de texto, más rápida y barata; las de diagramas e imágenes se siguen enviando como imagen")
+            if st.session_state.vlm_text_tier:
+                st.slider("Cobertura de texto mínima", min_value=0.5, max_value=1.0, value=0.8, step=0.05, key="vlm_text_threshold", help="Fracción del contenido de la diapositiva que debe ser texto para no enviar la imagen")
+            st.checkbox("Usar caché de respuestas", value=True, key="vlm_use_cache", help="Reutiliza las notas ya generadas para la misma diapositiva, prompt y modelo. Desactívalo para forzar una nueva generación")
+            st.checkbox("Optimizar imágenes para el modelo", value=True, key="vlm_optimize_images", help="Reduce cada diapositiva a la resolución de visión del modelo y la comprime como JPEG antes de enviarla")
+            if st.session_state.vlm_optimize_images:
+                st.checkbox("Medir la latencia frente a la imagen original", value=False, key="vlm_compare_latency", help="Tras generar todas las notas, envía la primera diapositiva sin optimizar y optimizada para comparar el tiempo de respuesta (dos peticiones más)")
                 
     with col_preview:
         st.write("### Preview de Diapositivas")
         col1, col2, col3 = st.columns([1,3,1])
-        num_slides = len(st.session_state.slides_images)
+        num_slides = len(store)
         slide_number = st.number_input("Diapositiva", min_value=1, max_value=num_slides, value=1, step=1)
         slide_index = slide_number - 1
         with col2:
-            st.image(st.session_state.slides_images[slide_index], caption=f"Diapositiva {slide_number}", use_container_width=True)
-        note = st.session_state.slides_notes[slide_index]
-        st.session_state.slides_notes[slide_index] = st.text_area(f"Notas para la diapositiva {slide_number}", value=note, height=68)
+            st.image(store.image(slide_index).thumbnail(), caption=f"Diapositiva {slide_number}", use_container_width=True)
+        note = store.note(slide_index)
+        store.set_note(slide_index, st.text_area(f"Notas para la diapositiva {slide_number}", value=note, height=68))
         # Nuevos botones de generación de notas en el preview
         if notes_mode == "Generar notas":
             col_gen1, col_gen2 = st.columns(2)
             with col_gen1:
                 if st.button("Generar Nota", key="gen_current_note", use_container_width=True):
-                    with st.spinner("Generando nota para la diapositiva..."):
-                        if st.session_state.vlm_model == "LLMStudio":
-                            vlm = get_vlm("LLMStudio", st.session_state.vlm_model_url, st.session_state.vlm_model_id)
-                        else:  # Gemini 2.0
-                            if not st.session_state.get("gemini_api_key"):
-                                st.error("Por favor ingresa la API Key para Gemini 2.0")
-                                st.stop()
-                            model_id = st.session_state.get("gemini_model_id", "gemini-2.0-flash")
-                            vlm = get_vlm("Gemini 2.0", "", model_id, st.session_state.gemini_api_key)
-                        st.session_state.slides_notes[slide_index] = vlm.process_single_slide(
-                            st.session_state.slides_images[slide_index],
-                            st.session_state.user_prompt,
-                            st.session_state.max_tokens  # se pasa max_tokens
-                        )
-                        st.success("✅ Nota generada correctamente")
+                    if st.session_state.vlm_model == "LLMStudio":
+                        vlm = get_vlm("LLMStudio", st.session_state.vlm_model_url, st.session_state.vlm_model_id, use_cache=st.session_state.vlm_use_cache, optimize_images=st.session_state.vlm_optimize_images)
+                    else:  # Gemini 2.0
+                        if not st.session_state.get("gemini_api_key"):
+                            st.error("Por favor ingresa la API Key para Gemini 2.0")
+                            st.stop()
+                        model_id = st.session_state.get("gemini_model_id", "gemini-2.0-flash")
+                        vlm = get_vlm("Gemini 2.0", "", model_id, st.session_state.gemini_api_key, use_cache=st.session_state.vlm_use_cache, optimize_images=st.session_state.vlm_optimize_images)
+                    # La nota se muestra según llegan los fragmentos y se guarda al terminar
+                    placeholder = st.empty()
+                    placeholder.info("Generando nota para la diapositiva...")
+                    generated_note = ""
+                    for chunk in vlm.stream_single_slide(
+                        store.image(slide_index),
+                        st.session_state.user_prompt,
+                        st.session_state.max_tokens  # se pasa max_tokens
+                    ):
+                        generated_note += chunk
+                        placeholder.markdown(generated_note)
+                    store.set_note(slide_index, generated_note)
+                    st.success("✅ Nota generada correctamente")
                     st.rerun()
 
             with col_gen2:
                 if st.button("Generar Notas para todas", key="gen_all_notes", use_container_width=True):
                     if st.session_state.vlm_model == "LLMStudio":
-                        vlm = get_vlm("LLMStudio", st.session_state.vlm_model_url, st.session_state.vlm_model_id)
+                        vlm = get_vlm("LLMStudio", st.session_state.vlm_model_url, st.session_state.vlm_model_id, use_cache=st.session_state.vlm_use_cache, optimize_images=st.session_state.vlm_optimize_images)
                     else:
                         if not st.session_state.get("gemini_api_key"):
                             st.error("Por favor ingresa la API Key para Gemini 2.0")
                             st.stop()
                         base_url = st.session_state.get("gemini_base_url", "http://localhost:1234/v1")
                         model_id = st.session_state.get("gemini_model_id", "gemini-default")
-                        vlm = get_vlm("Gemini 2.0", base_url, model_id, st.session_state.gemini_api_key)
-                    all_notes = []
-                    total = len(st.session_state.slides_images)
+                        vlm = get_vlm("Gemini 2.0", base_url, model_id, st.session_state.gemini_api_key, use_cache=st.session_state.vlm_use_cache, optimize_images=st.session_state.vlm_optimize_images)
                     progress_bar = st.progress(0)
-                    for idx, image in enumerate(st.session_state.slides_images):
-                        note = vlm.process_single_slide(
-                            image,
-                            st.session_state.user_prompt,
-                            st.session_state.max_tokens  # se pasa max_tokens
+                    progress_text = st.empty()
+
+                    def update_progress(done, total, idx):
+                        progress_bar.progress(done / total)
+                        progress_text.text(f"Diapositiva {idx + 1} generada ({done} de {total})")
+
+                    bulk_options = {}
+                    if st.session_state.vlm_model == "Gemini 2.0":
+                        bulk_options["requests_per_minute"] = st.session_state.get("gem_rpm") or None
+                    if st.session_state.vlm_text_tier:
+                        # La capa de texto solo se extrae (una vez por presentación) si se usa este nivel
+                        with st.spinner("Analizando el texto de las diapositivas..."):
+                            pptx_source = BytesIO(st.session_state.uploaded_file.getvalue()) if st.session_state.file_type == "pptx" else None
+                            ensure_text_layers(store, pptx_source)
+                        bulk_options["text_threshold"] = st.session_state.vlm_text_threshold
+                    all_notes = vlm.get_narrative_from_slides(
+                        store.text_layers(),
+                        store.images(),
+                        st.session_state.user_prompt,
+                        st.session_state.max_tokens,  # se pasa max_tokens
+                        max_workers=st.session_state.vlm_concurrency,
+                        progress_callback=update_progress,
+                        slides_per_request=st.session_state.vlm_slides_per_request,
+                        **bulk_options
+                    )
+                    progress_text.empty()
+                    store.set_notes(all_notes)
+                    payload = vlm.payload_report()
+                    if payload["images"]:
+                        st.toast(
+                            f"Imágenes enviadas: {payload['payload_bytes'] / 1e6:.1f} MB de {payload['source_bytes'] / 1e6:.1f} MB originales "
+                            f"(-{payload['saved_ratio']:.0%}), {payload['avg_request_seconds']:.1f} s de media por petición"
+                        )
+                    if st.session_state.vlm_optimize_images and st.session_state.get("vlm_compare_latency") and len(store):
+                        with st.spinner("Midiendo latencia con la imagen original..."):
+                            try:
+                                latency = vlm.compare_payload_latency(store.image(0), st.session_state.user_prompt, st.session_state.max_tokens)
+                            except Exception as e:
+                                latency = None
+                                st.warning(f"No se pudo medir la latencia: {e}")
+                        if latency:
+                            st.toast(
+                                f"Latencia con la diapositiva 1: {latency['optimized_seconds']:.1f} s optimizada "
+                                f"({latency['optimized_bytes'] / 1e6:.2f} MB) frente a {latency['original_seconds']:.1f} s "
+                                f"original ({latency['original_bytes'] / 1e6:.2f} MB), -{latency['saved_ratio']:.0%}"
+                            )
+                    tiers = vlm.tier_report()
+                    if tiers["text_slides"]:
+                        saved_time = f", ~{tiers['saved_seconds']:.0f} s ahorrados" if tiers["saved_seconds"] is not None else ""
+                        st.toast(
+                            f"{tiers['text_slides']} diapositivas por texto y {tiers['image_slides']} por imagen: "
+                            f"~{tiers['saved_bytes'] / 1e6:.1f} MB de imágenes sin enviar{saved_time}"
                         )
-                        all_notes.append(note)
-                        progress_bar.progress((idx + 1) / total)
-                        if st.session_state.vlm_model == "Gemini 2.0":
-                            # Recuperar el valor usando el key modificado
-                            gem_wait_time = st.session_state.get("gem_wait_time", 0)
-                            time.sleep(gem_wait_time / 1000)
-                    st.session_state.slides_notes = all_notes
                     st.success("✅ Notas generadas correctamente")
                     st.rerun()
         else:  # Modo "Traducir notas"
             if st.button("Traducir Nota", key="trans_current_note", use_container_width=True):
-                note = st.session_state.slides_notes[slide_index]
+                note = store.note(slide_index)
                 if note.strip():
                     with st.spinner("Traduciendo nota..."):
                         # Actualizar en el texto del spinner que se está descargando el modelo en el spinner
                         with st.spinner("Descargando modelo de traducción..."):
-                            translator_instance = Translator()
+                            translator_instance = Translator(backend=st.session_state.translation_backend)
                         translated = translator_instance.translate_notes(src_bcp47, tgt_bcp47, note)
-                        st.session_state.slides_notes[slide_index] = translated
+                        store.set_note(slide_index, translated)
                     st.success("✅ Nota traducida")
                     # Asegurarse que se refresca el renderizado del cuadro con las notas
                     st.rerun()
@@ -245,19 +339,31 @@ def step_configure_notes():
             if st.button("Traducir todas las notas", key="trans_all_notes", use_container_width=True):
                 progress_bar = st.progress(0)
                 progress_text = st.empty()
-                translated_notes = []
-                total = len(st.session_state.slides_notes)
-                for idx, n in enumerate(st.session_state.slides_notes):
-                    if not n.strip():
-                        translated_notes.append("")
-                        continue
-                    progress_bar.progress((idx + 1) / total)
-                    progress_text.text(f"Traduciendo diapositiva {idx + 1} de {total}")
-                    translator_instance = Translator()
-                    translated_notes.append(translator_instance.translate_notes(src_bcp47, tgt_bcp47, n))
+                with st.spinner("Cargando modelo de traducción..."):
+                    translator_instance = Translator(backend=st.session_state.translation_backend)
+
+                def update_progress(done, total):
+                    progress_bar.progress(done / total if total else 1.0)
+                    progress_text.text(f"Traducidas {done} de {total} frases")
+
+                memory_before = translator_instance.memory.stats()
+                translated_notes = translator_instance.translate_batch(
+                    src_bcp47, tgt_bcp47, store.notes(),
+                    batch_size=st.session_state.translation_batch_size,
+                    progress_callback=update_progress
+                )
                 progress_bar.progress(1.0)
                 progress_text.empty()
-                st.session_state.slides_notes = translated_notes
+                store.set_notes(translated_notes)
+                memory_after = translator_instance.memory.stats()
+                memory_hits = memory_after['hits'] - memory_before['hits']
+                memory_misses = memory_after['misses'] - memory_before['misses']
+                memory_lookups = memory_hits + memory_misses
+                memory_hit_rate = memory_hits / memory_lookups if memory_lookups else 0.0
+                st.toast(
+                    f"Memoria de traducción: {memory_hits} reutilizadas, {memory_misses} traducidas "
+                    f"({memory_hit_rate:.0%} de aciertos, {memory_after['entries']} frases guardadas)"
+                )
                 st.success("✅ Todas las notas traducidas correctamente")
                 st.rerun()
 
@@ -273,9 +379,7 @@ def step_configure_notes():
 
 # Función para el Paso 3: Configurar Audio
 def step_configure_audio():
-    # Asegurar que slides_notes_audios tenga la misma longitud que slides_notes
-    if 'slides_notes_audios' not in st.session_state or len(st.session_state.slides_notes_audios) != len(st.session_state.slides_notes):
-        st.session_state.slides_notes_audios = [None] * len(st.session_state.slides_notes)
+    store = st.session_state.slide_store
     col_config_audio, col_preview_audio = st.columns(2)
     with col_config_audio:
         st.write("### Configurar Audio")
@@ -297,6 +401,13 @@ def step_configure_audio():
             st.write("### Configuración de Idioma")
             languages = get_tts_provider(tts_provider_selected).get_available_languages()
             language = st.selectbox("Idioma", options=languages.keys(), format_func=lambda x: languages[x], key='language')
+            st.write("### Voz personalizada")
+            st.file_uploader(
+                "Audio de referencia (opcional)",
+                type=["wav", "mp3", "flac"],
+                key="xtts_reference_wav",
+                help="Unos segundos de voz limpia para clonarla. Sus latentes se calculan una vez y se reutilizan en las siguientes generaciones"
+            )
         elif tts_provider_selected == 'elevenlabs':
             st.write("### Configuración de ElevenLabs")
             st.write("API para generar audio a partir de texto.")
@@ -323,20 +434,22 @@ def step_configure_audio():
             if reference_audio:
                 st.audio(reference_audio, format="audio/wav")
             # Get the path to the audio file        
+        st.checkbox("Usar caché de audio", value=True, key="tts_use_cache", help="Reutiliza el audio ya generado para la misma nota, voz, idioma y modelo, también entre sesiones")
     with col_preview_audio:
         st.write("### Preview de Diapositivas con audio")
-        num_slides = len(st.session_state.slides_images)
+        num_slides = len(store)
         slide_number = st.number_input("Diapositiva", min_value=1, max_value=num_slides, value=1, step=1)
         slide_index = slide_number - 1
         col_img, col_audio = st.columns([1, 1])
         with col_img:
-            st.image(st.session_state.slides_images[slide_index], caption=f"Diapositiva {slide_number}", use_container_width=True)
-        new_note = st.text_area(f"Notas para la diapositiva {slide_number}", value=st.session_state.slides_notes[slide_index], height=68)
-        st.session_state.slides_notes[slide_index] = new_note
+            st.image(store.image(slide_index).thumbnail(), caption=f"Diapositiva {slide_number}", use_container_width=True)
+        new_note = st.text_area(f"Notas para la diapositiva {slide_number}", value=store.note(slide_index), height=68)
+        store.set_note(slide_index, new_note)
         
         with col_audio:
             if st.button("Generar audio para todas las diapositivas", key="gen_all_audio_btn"):
                 provider = tts_provider_selected
+                tts_options = {}
                 if provider == "elevenlabs":
                     api_key = st.session_state.get("elevenlabs_api_key", "")
                     if not api_key:
@@ -346,6 +459,12 @@ def step_configure_audio():
                     voice_id = st.session_state.get("selected_voice", "default_voice")
                     language = st.session_state.get("language", "Spanish")
                 
+                elif provider == "xttsv2":
+                    tts_client = get_tts_provider(provider)
+                    voice_id = st.session_state.get("selected_voice")
+                    language = st.session_state.get("language", "Spanish")
+                    tts_options["reference_wav"] = st.session_state.get("xtts_reference_wav")
+
                 elif provider == "chatterbox":
                     tts_client = get_tts_provider(provider, reference_voice=reference_audio)
                     voice_id = st.session_state.get("selected_voice", "default_voice")
@@ -353,20 +472,33 @@ def step_configure_audio():
 
                 progress_bar = st.progress(0)
                 progress_text = st.empty()
-                total = len(st.session_state.slides_notes)
 
-                for idx, note in enumerate(st.session_state.slides_notes):
-                    progress_bar.progress((idx + 1) / total)
-                    progress_text.text(f"Generando audio para diapositiva {idx + 1} de {total}")
-                    if note.strip():
-                        st.session_state.slides_notes_audios[idx] = tts_client.synthesize_text(voice_id, note, language=language)
+                def update_progress(done, total, idx):
+                    progress_bar.progress(done / total)
+                    progress_text.text(f"Audio de la diapositiva {idx + 1} generado ({done} de {total})")
+
+                cache_before = tts_cache_stats()
+                audios = tts_client.synthesize_many(
+                    voice_id, store.notes(), progress_callback=update_progress,
+                    use_cache=st.session_state.tts_use_cache, language=language, **tts_options
+                )
+                for idx, audio in enumerate(audios):
+                    if audio:
+                        store.set_audio(idx, audio)
                 progress_bar.empty()
                 progress_text.empty()
+                if st.session_state.tts_use_cache:
+                    cache_after = tts_cache_stats()
+                    st.toast(
+                        f"Caché de audio: {cache_after['hits'] - cache_before['hits']} reutilizados, "
+                        f"{cache_after['misses'] - cache_before['misses']} generados"
+                    )
                 st.success("Todos los audios generados correctamente.")
                 st.rerun()
             
             if new_note.strip() and st.button("Generar Audio", key=f"gen_audio_{slide_index}", use_container_width=True):
                 provider = tts_provider_selected
+                tts_options = {}
                 if provider == "elevenlabs":
                     api_key = st.session_state.get("elevenlabs_api_key", "")
                     if not api_key:
@@ -379,17 +511,18 @@ def step_configure_audio():
                     tts_client = get_tts_provider(provider)
                     voice_id = st.session_state.get("selected_voice")
                     language = st.session_state.get("language", "Spanish")
+                    tts_options["reference_wav"] = st.session_state.get("xtts_reference_wav")
                 else:
                     tts_client = get_tts_provider(provider,reference_voice=reference_audio)
                     voice_id = st.session_state.get("selected_voice", "default_voice")
                     language = st.session_state.get("language", "Spanish")
                 
-                st.session_state.slides_notes_audios[slide_index] = tts_client.synthesize_text(voice_id, new_note, language=language)
+                store.set_audio(slide_index, tts_client.synthesize(voice_id, new_note, use_cache=st.session_state.tts_use_cache, language=language, **tts_options))
                 st.success("Audio generado correctamente.")
                 st.rerun()
                 
-            if st.session_state.slides_notes_audios[slide_index]:
-                st.audio(st.session_state.slides_notes_audios[slide_index], format="audio/mp3")
+            if store.audio(slide_index):
+                st.audio(store.audio(slide_index), format="audio/mp3")
 
         col_nav1, col_nav2 = st.columns([1, 1])
         with col_nav1:
@@ -415,6 +548,14 @@ def step_generate_video():
         )
         default_duration = st.number_input("Duración (segundos) para diapositivas sin audio", min_value=1.0, value=3.0, step=0.5, key="default_duration")
         transition_silence = st.number_input("Tiempo de silencio en transiciones (segundos)", min_value=0.0, value=0.0, step=0.5, key="transition_silence")
+        render_engine = st.selectbox(
+            "Motor de renderizado",
+            options=['ffmpeg', 'segments', 'moviepy'],
+            format_func=lambda x: 'ffmpeg nativo (rápido)' if x == 'ffmpeg' else 'Segmentos en paralelo' if x == 'segments' else 'MoviePy',
+            key='render_engine'
+        )
+        if render_engine == 'segments':
+            st.number_input("Procesos de renderizado", min_value=1, value=os.cpu_count() or 1, step=1, key="render_workers", help="Número de diapositivas que se codifican a la vez")
         fps = 1
         
         if st.button("🚀 Generar Video 🚀", use_container_width=True, type="primary"):
@@ -427,11 +568,15 @@ def step_generate_video():
             progress_bar = st.progress(0)
             status_text = st.empty()
 
-            slides_images = st.session_state.slides_images
-            slides_audios = st.session_state.slides_notes_audios
+            # Las imágenes y audios se leen del almacén en disco bajo demanda
+            store = st.session_state.slide_store
+            slides_images = store.images()
+            slides_audios = store.audios()
             default_duration = st.session_state.default_duration
             fps = 1
             transition_silence = st.session_state.transition_silence
+            render_engine = st.session_state.render_engine
+            render_workers = st.session_state.get("render_workers")
 
             # Variable compartida para almacenar el resultado
             video_output = {"path": None}
@@ -445,7 +590,9 @@ def step_generate_video():
                     output_file,
                     fps,
                     transition_silence,
-                    progress_queue
+                    progress_queue,
+                    engine=render_engine,
+                    workers=render_workers
                 )
 
             # Lanzar el hilo de generación de video
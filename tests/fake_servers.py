@@ -0,0 +1,210 @@
+import json
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+Módulo: fake_servers.py
+
+Servidores HTTP locales que imitan las APIs externas (solo biblioteca
+estándar) para probar los clientes sin red ni claves: cada servidor escucha en
+un puerto libre de 127.0.0.1 mientras dura el bloque `with` y registra las
+peticiones recibidas.
+"""
+
+
+class FakeServer:
+    """Base: arranca un ThreadingHTTPServer en segundo plano con el manejador de la subclase."""
+
+    def __init__(self, fail_first: int = 0) -> None:
+        self.fail_first = fail_first
+        self.requests = []
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def handle(self, handler: BaseHTTPRequestHandler, body: dict) -> None:
+        raise NotImplementedError
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    body = {}
+                fake.handle(self, body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _take_rate_limit(self) -> bool:
+        """Consume uno de los 429 configurados; indica si esta petición debe rechazarse."""
+        with self._lock:
+            if self.rate_limited < self.fail_first:
+                self.rate_limited += 1
+                return True
+            return False
+
+    @staticmethod
+    def send_json(handler: BaseHTTPRequestHandler, status: int, payload: dict, headers: dict = None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+class FakeOpenAIServer(FakeServer):
+    """
+    `POST /v1/chat/completions` compatible con OpenAI (como LM Studio).
+    Responde siempre `reply`, en JSON o en streaming SSE troceado cada
+    `chunk_size` caracteres, y devuelve 429 a las `fail_first` primeras
+    peticiones.
+    """
+
+    def __init__(self, reply: str = "Narración de prueba de la diapositiva.", fail_first: int = 0, chunk_size: int = 8):
+        super().__init__(fail_first)
+        self.reply = reply
+        self.chunk_size = chunk_size
+
+    @property
+    def base_url(self) -> str:
+        return super().base_url + "/v1"
+
+    def handle(self, handler: BaseHTTPRequestHandler, body: dict) -> None:
+        if handler.path.rstrip("/") != "/v1/chat/completions":
+            self.send_json(handler, 404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+        with self._lock:
+            self.requests.append(body)
+        if self._take_rate_limit():
+            self.send_json(
+                handler, 429,
+                {"error": {"message": "Rate limit exceeded", "type": "rate_limit_exceeded"}},
+                {"Retry-After": "0"},
+            )
+            return
+
+        created = int(time.time())
+        model = body.get("model", "fake-model")
+        if not body.get("stream"):
+            self.send_json(handler, 200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.reply},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+            return
+
+        # HTTP/1.0 sin Content-Length: el cierre de la conexión marca el final del stream
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Cache-Control", "no-cache")
+        handler.end_headers()
+        pieces = [self.reply[i:i + self.chunk_size] for i in range(0, len(self.reply), self.chunk_size)]
+        for piece, finish_reason in [(p, None) for p in pieces] + [(None, "stop")]:
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": piece} if piece is not None else {},
+                    "finish_reason": finish_reason,
+                }],
+            }
+            handler.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            handler.wfile.flush()
+        handler.wfile.write(b"data: [DONE]\n\n")
+        handler.wfile.flush()
+
+
+class FakeElevenLabsServer(FakeServer):
+    """
+    `POST /v1/text-to-speech/{voice_id}` de ElevenLabs. Cada petición tarda
+    `latency` segundos y devuelve como audio `audio_for(voice_id, text)`.
+    Devuelve 429 a las `fail_first` primeras peticiones y, con
+    `concurrency_limit`, a las que superen ese número de peticiones en curso
+    (como el límite de concurrencia del plan). Registra el máximo de
+    peticiones simultáneas en `max_active`.
+    """
+
+    path_pattern = re.compile(r"^/v1/text-to-speech/([^/]+)(?:/stream)?$")
+
+    def __init__(self, latency: float = 0.0, fail_first: int = 0, concurrency_limit: int = None):
+        super().__init__(fail_first)
+        self.latency = latency
+        self.concurrency_limit = concurrency_limit
+        self.active = 0
+        self.max_active = 0
+
+    @staticmethod
+    def audio_for(voice_id: str, text: str) -> bytes:
+        return f"ID3|{voice_id}|{text}".encode("utf-8")
+
+    def handle(self, handler: BaseHTTPRequestHandler, body: dict) -> None:
+        url = urlsplit(handler.path)
+        match = self.path_pattern.match(url.path)
+        if not match:
+            self.send_json(handler, 404, {"detail": "Not Found"})
+            return
+        voice_id = match.group(1)
+        with self._lock:
+            self.requests.append({"voice_id": voice_id, "query": parse_qs(url.query), **body})
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            over_limit = self.concurrency_limit is not None and self.active > self.concurrency_limit
+        try:
+            if self._take_rate_limit() or over_limit:
+                if over_limit:
+                    with self._lock:
+                        self.rate_limited += 1
+                self.send_json(handler, 429, {"detail": {
+                    "status": "too_many_concurrent_requests",
+                    "message": "Too many concurrent requests",
+                }})
+                return
+            time.sleep(self.latency)
+            audio = self.audio_for(voice_id, body.get("text", ""))
+            handler.send_response(200)
+            handler.send_header("Content-Type", "audio/mpeg")
+            handler.send_header("Content-Length", str(len(audio)))
+            handler.end_headers()
+            handler.wfile.write(audio)
+        finally:
+            with self._lock:
+                self.active -= 1
@@ -0,0 +1,46 @@
+import pytest
+
+for module in ("torch", "transformers"):
+    pytest.importorskip(module)
+
+from utils import TranlationUtils
+
+NOTES = ["Hola a todos. Empezamos.", "", "Gracias."]
+
+
+@pytest.fixture
+def translator(tmp_path, monkeypatch):
+    """Traductor sin modelo: `_translate_segments` devuelve los segmentos en mayúsculas."""
+    translator = object.__new__(TranlationUtils.Translator)
+    translator.memory_model_id = "fake-model"
+    translator.memory = TranlationUtils.TranslationMemory(path=str(tmp_path / "memory.sqlite3"))
+    translator.calls = []
+
+    def translate_segments(source_lang, target_lang, segments, batch_size, progress_callback=None):
+        translator.calls.append(list(segments))
+        if progress_callback:
+            progress_callback(len(segments), len(segments))
+        return [segment.upper() for segment in segments]
+
+    monkeypatch.setattr(translator, "_fit_to_window", lambda text: [text], raising=False)
+    monkeypatch.setattr(translator, "_translate_segments", translate_segments, raising=False)
+    return translator
+
+
+def test_empty_notes_do_not_report_progress(translator):
+    progress = []
+    result = translator.translate_batch("spa_Latn", "eng_Latn", ["", "  ", ""], progress_callback=lambda *args: progress.append(args))
+
+    assert result == ["", "  ", ""]
+    assert progress == []
+    assert translator.calls == []
+
+
+def test_memory_hits_report_full_progress(translator):
+    first = translator.translate_batch("spa_Latn", "eng_Latn", NOTES)
+    progress = []
+    second = translator.translate_batch("spa_Latn", "eng_Latn", NOTES, progress_callback=lambda *args: progress.append(args))
+
+    assert first == second == ["HOLA A TODOS. EMPEZAMOS.", "", "GRACIAS."]
+    assert len(translator.calls) == 1
+    assert progress == [(3, 3)]
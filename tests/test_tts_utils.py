@@ -0,0 +1,83 @@
+import pytest
+
+for module in ("numpy", "soundfile", "torch", "torchaudio", "TTS", "httpx", "elevenlabs"):
+    pytest.importorskip(module)
+
+from tests.fake_servers import FakeElevenLabsServer
+from utils import CacheUtils, TTSUtils
+
+VOICE_ID = "fake-voice"
+TEXTS = [f"Nota de la diapositiva {idx}." for idx in range(12)]
+
+
+@pytest.fixture(autouse=True)
+def tts_cache(tmp_path, monkeypatch):
+    """Caché de audio aislada en un directorio temporal."""
+    monkeypatch.setattr(CacheUtils, "CACHE_ROOT", str(tmp_path))
+    monkeypatch.setattr(TTSUtils, "_tts_cache", None)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Registra las esperas del backoff sin dormir de verdad."""
+    delays = []
+    monkeypatch.setattr(TTSUtils.time, "sleep", delays.append)
+    return delays
+
+
+def make_engine(server, max_workers):
+    engine = TTSUtils.ElevenLabsTTS("fake-key", base_url=server.base_url, max_workers=max_workers)
+    engine.backoff_base = 0.01
+    return engine
+
+
+def test_synthesize_many_keeps_order_and_caps_concurrency():
+    progress = []
+    with FakeElevenLabsServer(latency=0.05) as server:
+        engine = make_engine(server, max_workers=3)
+        audios = engine.synthesize_many(
+            VOICE_ID, TEXTS, use_cache=False,
+            progress_callback=lambda done, total, idx: progress.append((done, total, idx))
+        )
+
+    assert audios == [server.audio_for(VOICE_ID, text) for text in TEXTS]
+    assert 1 < server.max_active <= 3
+    assert [done for done, _, _ in progress] == list(range(1, len(TEXTS) + 1))
+    assert sorted(idx for _, _, idx in progress) == list(range(len(TEXTS)))
+    assert server.requests[0]["model_id"] == engine.default_model_id
+    assert server.requests[0]["query"]["output_format"] == [engine.default_format]
+
+
+def test_retries_rate_limited_requests_with_backoff(sleeps):
+    with FakeElevenLabsServer(fail_first=2) as server:
+        audio = make_engine(server, max_workers=1).synthesize(VOICE_ID, TEXTS[0], use_cache=False)
+
+    assert audio == server.audio_for(VOICE_ID, TEXTS[0])
+    assert len(server.requests) == 3
+    # Backoff exponencial con jitter: base * 2**intento + [0, base)
+    assert len(sleeps) == 2
+    assert 0.01 <= sleeps[0] <= 0.02
+    assert 0.02 <= sleeps[1] <= 0.03
+
+
+def test_gives_up_after_max_retries(sleeps):
+    with FakeElevenLabsServer(fail_first=10) as server:
+        engine = make_engine(server, max_workers=1)
+        engine.max_retries = 2
+        audio = engine.synthesize(VOICE_ID, TEXTS[0], use_cache=False)
+
+    assert audio == b""
+    assert len(server.requests) == 3
+    assert len(sleeps) == 2
+
+
+def test_concurrency_limit_responses_are_retried():
+    # Más peticiones simultáneas de las que admite el plan: las rechazadas se reintentan
+    with FakeElevenLabsServer(latency=0.02, concurrency_limit=2) as server:
+        engine = make_engine(server, max_workers=4)
+        engine.max_retries = 10
+        audios = engine.synthesize_many(VOICE_ID, TEXTS, use_cache=False)
+
+    assert audios == [server.audio_for(VOICE_ID, text) for text in TEXTS]
+    assert server.rate_limited > 0
+    assert len(server.requests) == len(TEXTS) + server.rate_limited
@@ -0,0 +1,169 @@
+import io
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("google.genai")
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+from tests.fake_servers import FakeOpenAIServer
+from utils import CacheUtils, VLMUtils
+from utils.SlideUtils import RawSlide
+
+PROMPT = "Describe la diapositiva."
+
+
+@pytest.fixture(autouse=True)
+def vlm_cache(tmp_path, monkeypatch):
+    """Caché de respuestas aislada en un directorio temporal."""
+    monkeypatch.setattr(CacheUtils, "CACHE_ROOT", str(tmp_path))
+    monkeypatch.setattr(VLMUtils, "_vlm_cache", None)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Registra las esperas del backoff sin dormir de verdad."""
+    delays = []
+    monkeypatch.setattr(VLMUtils.time, "sleep", delays.append)
+    return delays
+
+
+@pytest.fixture
+def slide():
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def make_vlm(server, use_cache=False):
+    vlm = VLMUtils.get_vlm("LLMStudio", server.base_url, "fake-model", use_cache=use_cache, optimize_images=False)
+    vlm.backoff_base = 0.01
+    return vlm
+
+
+def test_retries_rate_limited_requests_with_backoff(slide, sleeps):
+    with FakeOpenAIServer(fail_first=2) as server:
+        narration = make_vlm(server).process_single_slide(slide, PROMPT)
+
+    assert narration == server.reply
+    assert len(server.requests) == 3
+    assert server.rate_limited == 2
+    # Backoff exponencial con jitter: base * 2**intento + [0, base)
+    assert len(sleeps) == 2
+    assert 0.01 <= sleeps[0] <= 0.02
+    assert 0.02 <= sleeps[1] <= 0.03
+    image_url = server.requests[-1]["messages"][1]["content"][1]["image_url"]["url"]
+    assert image_url.startswith("data:image/png;base64,")
+
+
+def test_gives_up_after_max_retries(slide, sleeps):
+    with FakeOpenAIServer(fail_first=10) as server:
+        vlm = make_vlm(server)
+        vlm.max_retries = 2
+        narration = vlm.process_single_slide(slide, PROMPT)
+
+    assert narration == ""
+    assert len(server.requests) == 3
+    assert len(sleeps) == 2
+
+
+def test_cache_serves_repeated_requests(slide):
+    with FakeOpenAIServer() as server:
+        first = make_vlm(server, use_cache=True).process_single_slide(slide, PROMPT)
+        # Una instancia nueva comparte la caché en disco
+        second = make_vlm(server, use_cache=True).process_single_slide(slide, PROMPT)
+        assert len(server.requests) == 1
+        make_vlm(server, use_cache=True).process_single_slide(slide, PROMPT + " Sé breve.")
+        assert len(server.requests) == 2
+
+    assert first == second == server.reply
+    assert VLMUtils.get_vlm_cache().hits == 1
+
+
+def test_stream_single_slide_yields_chunks(slide, sleeps):
+    with FakeOpenAIServer(fail_first=1, chunk_size=5) as server:
+        vlm = make_vlm(server, use_cache=True)
+        chunks = list(vlm.stream_single_slide(slide, PROMPT))
+        # El 429 llega antes del primer fragmento, así que se reintenta
+        assert len(server.requests) == 2
+        assert len(sleeps) == 1
+        assert server.requests[-1]["stream"] is True
+
+        # La respuesta completa queda en caché y se entrega de una vez
+        cached = list(vlm.stream_single_slide(slide, PROMPT))
+        assert len(server.requests) == 2
+
+    assert len(chunks) == -(-len(server.reply) // 5)
+    assert "".join(chunks) == server.reply
+    assert cached == [server.reply]
+
+
+def test_gemini_cache_key_ignores_base_url(slide):
+    # El cliente de Gemini no usa base_url: la nota individual y la masiva comparten caché
+    single = VLMUtils.get_vlm("Gemini 2.0", "", "gemini-model", "fake-key")
+    bulk = VLMUtils.get_vlm("Gemini 2.0", "http://localhost:1234/v1", "gemini-model", "fake-key")
+    assert single._cache_key([slide], PROMPT, 1000) == bulk._cache_key([slide], PROMPT, 1000)
+
+    with FakeOpenAIServer() as server:
+        local = make_vlm(server)
+        other = VLMUtils.get_vlm("LLMStudio", "http://localhost:1/v1", "fake-model", optimize_images=False)
+        assert local._cache_key([slide], PROMPT, 1000) != other._cache_key([slide], PROMPT, 1000)
+
+
+def test_compare_payload_latency_sends_original_and_optimized():
+    buffer = io.BytesIO()
+    Image.effect_noise((2000, 1500), 64).convert("RGB").save(buffer, format="PNG")
+    large_slide = buffer.getvalue()
+
+    with FakeOpenAIServer() as server:
+        vlm = VLMUtils.get_vlm("LLMStudio", server.base_url, "fake-model", use_cache=True)
+        latency = vlm.compare_payload_latency(large_slide, PROMPT)
+        assert len(server.requests) == 2
+
+    urls = [request["messages"][1]["content"][1]["image_url"]["url"] for request in server.requests]
+    assert urls[0].startswith("data:image/png;base64,")
+    assert urls[1].startswith("data:image/jpeg;base64,")
+    assert latency["original_bytes"] == len(large_slide)
+    assert latency["optimized_bytes"] < latency["original_bytes"]
+    assert latency["original_seconds"] > 0 and latency["optimized_seconds"] > 0
+    # La medida no contamina las estadísticas ni la caché de la instancia
+    assert vlm.payload_stats["requests"] == 0
+    assert VLMUtils.get_vlm_cache().misses == 0
+
+
+def test_text_tier_reports_unsent_bytes_without_encoding(slide, monkeypatch):
+    encoded = []
+    encode_payload = VLMUtils.encode_payload
+    monkeypatch.setattr(VLMUtils, "encode_payload", lambda image_obj, *args: encoded.append(image_obj) or encode_payload(image_obj, *args))
+    text_layers = [
+        {"slide_num": 1, "content": "Una diapositiva con mucho texto. " * 4, "text_coverage": 1.0},
+        {"slide_num": 2, "content": "", "text_coverage": 0.0},
+    ]
+
+    with FakeOpenAIServer() as server:
+        vlm = VLMUtils.get_vlm("LLMStudio", server.base_url, "fake-model", use_cache=False)
+        narratives = vlm.get_narrative_from_slides(text_layers, [slide, slide], PROMPT, text_threshold=0.8)
+
+    assert narratives == [server.reply, server.reply]
+    # Solo se codifica la imagen que se envía; la del nivel de texto se estima con la media
+    assert len(encoded) == 1
+    report = vlm.tier_report()
+    assert report["text_slides"] == 1 and report["image_slides"] == 1
+    assert report["saved_bytes"] == vlm.payload_report()["payload_bytes"]
+
+
+def test_optimized_payload_does_not_keep_png_on_raw_slide(tmp_path):
+    path = tmp_path / "slide.rgb"
+    np.full((480, 640, 3), 255, dtype=np.uint8).tofile(path)
+    raw_slide = RawSlide(str(path), 640, 480)
+
+    with FakeOpenAIServer() as server:
+        vlm = VLMUtils.get_vlm("LLMStudio", server.base_url, "fake-model", use_cache=False)
+        vlm.process_single_slide(raw_slide, PROMPT)
+
+    # El tamaño de referencia son las muestras crudas: no se codifica ni se memoriza un PNG
+    assert raw_slide.cached_bytes("PNG") is None
+    report = vlm.payload_report()
+    assert report["source_bytes"] == 640 * 480 * 3
+    assert 0 < report["payload_bytes"] < report["source_bytes"]
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+"""
+Módulo: CacheUtils.py
+
+Utilidades de caché en disco direccionada por contenido. Las claves son hashes
+SHA-256 de las entradas que determinan el resultado, de modo que una entrada
+solo se reutiliza si todas sus entradas son idénticas. Todas las cachés viven
+bajo un mismo directorio raíz (configurable con SLIDES2VIDEO_CACHE_DIR).
+"""
+
+CACHE_ROOT = os.environ.get(
+    "SLIDES2VIDEO_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "slides2video")
+)
+
+
+def get_cache_dir(name: str) -> str:
+    """Devuelve (creándolo si hace falta) el directorio de la caché `name`."""
+    directory = os.path.join(CACHE_ROOT, name)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _update_hash(digest, part) -> None:
+    if part is None:
+        digest.update(b"N")
+        return
+    if isinstance(part, str):
+        data = part.encode("utf-8")
+        tag = b"S"
+    elif isinstance(part, (bytes, bytearray, memoryview)):
+        data = bytes(part) if isinstance(part, memoryview) and not part.contiguous else part
+        tag = b"B"
+    elif isinstance(part, (bool, int, float)):
+        data = repr(part).encode("utf-8")
+        tag = b"V"
+    elif isinstance(part, (dict, list, tuple)):
+        data = json.dumps(part, sort_keys=True, default=str).encode("utf-8")
+        tag = b"J"
+    elif hasattr(part, "__array_interface__"):
+        # Arrays de NumPy (incluidos memmaps): se hashea el buffer y la forma
+        _update_hash(digest, [list(part.shape), str(part.dtype)])
+        data = memoryview(part.tobytes() if not part.flags["C_CONTIGUOUS"] else part).cast("B")
+        tag = b"A"
+    else:
+        data = repr(part).encode("utf-8")
+        tag = b"R"
+    digest.update(tag + str(len(data)).encode("ascii") + b":")
+    digest.update(data)
+
+
+def hash_content(*parts) -> str:
+    """
+    Hash SHA-256 estable de una secuencia de partes (bytes, texto, números,
+    diccionarios/listas serializables en JSON o arrays de NumPy).
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        _update_hash(digest, part)
+    return digest.hexdigest()
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """Hash SHA-256 del contenido de un fichero, leído por bloques."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Caché en disco clave → fichero con expulsión LRU por tamaño.
+
+    La fecha de modificación de cada entrada se actualiza en cada acierto, por
+    lo que al superar `max_bytes` se eliminan primero las menos usadas.
+    """
+
+    def __init__(self, name: str, max_bytes: int = None, suffix: str = "") -> None:
+        self.name = name
+        self.directory = get_cache_dir(name)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.suffix)
+
+    def temp_path(self, key: str) -> str:
+        """Ruta temporal en el mismo directorio para escribir una entrada antes de `commit`."""
+        return os.path.join(self.directory, f"{key}.tmp-{uuid.uuid4().hex}{self.suffix}")
+
+    def lookup(self, key: str):
+        """Devuelve la ruta de la entrada si existe (contando acierto/fallo) o None."""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def get(self, key: str):
+        """Devuelve el contenido de la entrada o None."""
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def commit(self, key: str, temp_path: str) -> str:
+        """Mueve de forma atómica un fichero ya escrito a su entrada definitiva."""
+        path = self.path_for(key)
+        os.replace(temp_path, path)
+        self.evict()
+        return path
+
+    def put(self, key: str, data: bytes) -> str:
+        temp_path = self.temp_path(key)
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        return self.commit(key, temp_path)
+
+    def evict(self) -> None:
+        """Elimina las entradas menos usadas hasta quedar por debajo de `max_bytes`."""
+        if not self.max_bytes:
+            return
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file() or ".tmp-" in entry.name:
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,179 @@
+import asyncio
+import itertools
+import logging
+import os
+import queue
+import socket
+import sys
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from pptx2pdfwasm import PPTXtoPDFConverter
+
+"""
+Módulo: ConverterUtils.py
+
+Pool de conversores PPTX → PDF (pptx2pdfwasm) que se mantienen arrancados
+durante toda la vida del proceso. Cada conversor vive en su propio hilo (el
+navegador headless está ligado al hilo que lo arranca), usa un puerto libre
+asignado automáticamente y se reinicia si deja de responder, falla una
+conversión o supera el tiempo límite. Las conversiones esperan en una cola común hasta que hay un
+conversor libre, de modo que varias sesiones pueden convertir a la vez.
+"""
+
+# Número de conversores del pool (configurable por variable de entorno)
+CONVERTER_POOL_SIZE = int(os.environ.get("SLIDES2VIDEO_CONVERTERS", "2"))
+# Tiempo máximo (segundos) que se espera una conversión, incluida la espera en cola
+CONVERTER_TIMEOUT = float(os.environ.get("SLIDES2VIDEO_CONVERTER_TIMEOUT", "300"))
+
+logger = logging.getLogger(__name__)
+
+
+def _free_port() -> int:
+    """Pide al sistema operativo un puerto TCP libre en localhost."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _port_open(port: int, timeout: float = 1.0) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+class ConverterPool:
+    """Pool de `size` conversores pptx2pdfwasm calientes con cola de conversiones."""
+
+    def __init__(self, size: int = CONVERTER_POOL_SIZE) -> None:
+        self.size = max(1, size)
+        self._jobs = queue.Queue()
+        # Conversión en curso → estado del trabajador que la ejecuta
+        self._running = {}
+        self._lock = threading.Lock()
+        self._worker_ids = itertools.count()
+        if sys.platform.startswith('win') and sys.version_info >= (3, 8):
+            asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+        for _ in range(self.size):
+            self._spawn_worker()
+
+    def _spawn_worker(self) -> None:
+        state = {"converter": None, "retired": threading.Event()}
+        worker = threading.Thread(target=self._worker, args=(state,), name=f"pptx2pdf-{next(self._worker_ids)}", daemon=True)
+        worker.start()
+
+    def _start_converter(self):
+        port = _free_port()
+        converter = PPTXtoPDFConverter(headless=True, log_enabled=False, port=port)
+        converter.start_server()
+        return converter, port
+
+    def _stop_converter(self, converter) -> None:
+        try:
+            converter.stop_server()
+        except Exception as e:
+            logger.warning(f"Error al detener el conversor: {e}")
+
+    def _worker(self, state: dict) -> None:
+        converter, port = None, None
+        try:
+            # Arranque en caliente: el conversor queda listo antes de la primera subida
+            converter, port = self._start_converter()
+        except Exception as e:
+            logger.error(f"No se pudo arrancar el conversor: {e}")
+        state["converter"] = converter
+
+        retired = state["retired"]
+        while not retired.is_set():
+            pptx_path, pdf_path, future = self._jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            with self._lock:
+                self._running[future] = state
+            try:
+                for attempt in range(2):
+                    try:
+                        # Comprobación de salud: reiniciar si el servidor dejó de responder
+                        if converter is not None and not _port_open(port):
+                            logger.warning(f"El conversor del puerto {port} no responde, reiniciando")
+                            self._stop_converter(converter)
+                            converter = None
+                        if converter is None:
+                            converter, port = self._start_converter()
+                        state["converter"] = converter
+                        converter.convert(pptx_path, pdf_path)
+                        break
+                    except Exception:
+                        if converter is not None:
+                            self._stop_converter(converter)
+                        converter = None
+                        state["converter"] = None
+                        # Tras un timeout el cliente ya no espera: no se reintenta
+                        if attempt or retired.is_set():
+                            raise
+                future.set_result(pdf_path)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._running.pop(future, None)
+
+        # Trabajador retirado por un timeout: el pool ya arrancó otro en su lugar
+        if converter is not None:
+            self._stop_converter(converter)
+
+    def _abort(self, future: Future) -> None:
+        """
+        Abandona una conversión que superó el tiempo límite. Si seguía en cola
+        se cancela; si estaba en curso se detiene su conversor (el trabajador
+        bloqueado termina al desbloquearse) y se arranca un trabajador nuevo
+        para no perder capacidad.
+        """
+        if future.cancel():
+            return
+        with self._lock:
+            state = self._running.pop(future, None)
+        if state is None or state["retired"].is_set():
+            return
+        state["retired"].set()
+        logger.warning("Una conversión superó el tiempo límite, reiniciando su conversor")
+        if state["converter"] is not None:
+            self._stop_converter(state["converter"])
+        self._spawn_worker()
+
+    def submit(self, pptx_path: str, pdf_path: str) -> Future:
+        """Encola una conversión y devuelve un Future con la ruta del PDF."""
+        future = Future()
+        self._jobs.put((pptx_path, pdf_path, future))
+        return future
+
+    def convert(self, pptx_path: str, pdf_path: str, timeout: float = CONVERTER_TIMEOUT) -> str:
+        """
+        Convierte el PPTX a PDF esperando el turno en la cola del pool. Si no
+        termina en `timeout` segundos se abandona, se reinicia el conversor
+        que la ejecutaba y se lanza `TimeoutError`.
+        """
+        future = self.submit(pptx_path, pdf_path)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            self._abort(future)
+            raise TimeoutError(f"La conversión a PDF no terminó en {timeout:g} s") from None
+
+    def pending(self) -> int:
+        """Número de conversiones esperando un conversor libre."""
+        return self._jobs.qsize()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_converter_pool(size: int = None) -> ConverterPool:
+    """Devuelve el pool de conversores del proceso, creándolo la primera vez."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConverterPool(size or CONVERTER_POOL_SIZE)
+        return _pool
@@ -7,12 +7,30 @@ import fitz  # PyMuPDF
 from pptx.util import Inches
 from PIL import Image
 from pptx.enum.shapes import MSO_SHAPE_TYPE
+import multiprocessing
 import os
+import shutil
 import tempfile
-from pptx2pdfwasm import PPTXtoPDFConverter
-import sys
-import asyncio
+from utils.ConverterUtils import get_converter_pool
+import threading
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from utils.CacheUtils import hash_content
+from utils.SlideUtils import SOURCE_PDF_NAME, RawSlide, SlideStore, release_slides, sweep_session_stores
 
+# Alturas de salida del vídeo: el rasterizado se ajusta a ellas en lugar de usar un dpi fijo
+RASTER_RESOLUTIONS = {"720p": 720, "1080p": 1080, "1440p": 1440}
+DEFAULT_TARGET_HEIGHT = 1080
+# Procesos para rasterizar PDFs (0 = todos los núcleos) y mínimo de páginas para paralelizar
+RASTER_WORKERS = int(os.environ.get("SLIDES2VIDEO_RASTER_WORKERS", "0"))
+RASTER_PARALLEL_MIN_PAGES = 8
+# Presentaciones ya procesadas que se conservan en memoria (LRU)
+UPLOAD_CACHE_MAX_ENTRIES = int(os.environ.get("SLIDES2VIDEO_UPLOAD_CACHE", "8"))
+# Imágenes o dibujos que ocupan más de esta fracción de la página se consideran fondo
+TEXT_LAYER_BACKGROUND_RATIO = 0.9
 
 def detect_file_type(file):
     """Detecta si el archivo es PDF o PPTX"""
@@ -32,23 +50,136 @@ def get_file_stats(file_type, file):
                 "Páginas": len(pdf_reader.pages),
             }
         else:  # pptx
-            prs = Presentation(BytesIO(file.getvalue()))
-            slides_with_notes = sum(1 for slide in prs.slides if slide.notes_slide and 
-                                  slide.notes_slide.notes_text_frame.text.strip())
+            notes = read_pptx_notes(BytesIO(file.getvalue()))
+            slides_with_notes = sum(1 for note in notes if note)
             return {
                 "Tipo": "PowerPoint",
-                "Diapositivas": len(prs.slides),
+                "Diapositivas": len(notes),
                 "Con notas": slides_with_notes,
-                "Sin notas": len(prs.slides) - slides_with_notes,
-                "Total caracteres notas": sum(
-                    len(slide.notes_slide.notes_text_frame.text.strip())
-                    for slide in prs.slides if slide.notes_slide
-                )
+                "Sin notas": len(notes) - slides_with_notes,
+                "Total caracteres notas": sum(len(note) for note in notes)
             }
     except Exception as e:
         st.error(f"Error al procesar el archivo: {str(e)}")
         return None
 
+# Espacios de nombres y tipos de relación de PresentationML usados por el lector de notas
+_PPTX_NS_P = "{http://schemas.openxmlformats.org/presentationml/2006/main}"
+_PPTX_NS_A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+_PPTX_NS_R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PPTX_NS_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_PPTX_NOTES_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/notesSlide"
+
+def _read_pptx_rels(archive: zipfile.ZipFile, part_name: str) -> Dict[str, Tuple[str, str]]:
+    """Relaciones de una parte del paquete: rId → (tipo, ruta de la parte destino)."""
+    rels_name = posixpath.join(posixpath.dirname(part_name), "_rels", posixpath.basename(part_name) + ".rels")
+    if rels_name not in archive.NameToInfo:
+        return {}
+    rels = {}
+    with archive.open(rels_name) as stream:
+        for _, elem in ET.iterparse(stream):
+            if elem.tag == _PPTX_NS_REL + "Relationship" and elem.get("TargetMode") != "External":
+                target = posixpath.normpath(posixpath.join(posixpath.dirname(part_name), elem.get("Target")))
+                rels[elem.get("Id")] = (elem.get("Type"), target)
+            elem.clear()
+    return rels
+
+def _read_notes_text(stream) -> str:
+    """
+    Texto del marcador de cuerpo de una diapositiva de notas (equivalente a
+    `notes_text_frame.text` de python-pptx), leído de forma incremental.
+    """
+    paragraphs, runs = [], []
+    is_body = False
+    for _, elem in ET.iterparse(stream):
+        tag = elem.tag
+        if tag == _PPTX_NS_A + "t":
+            runs.append(elem.text or "")
+        elif tag == _PPTX_NS_A + "br":
+            runs.append("\v")
+        elif tag == _PPTX_NS_A + "p":
+            paragraphs.append("".join(runs))
+            runs = []
+        elif tag == _PPTX_NS_P + "ph":
+            is_body = is_body or elem.get("type") == "body"
+        elif tag == _PPTX_NS_P + "sp":
+            if is_body:
+                return "\n".join(paragraphs)
+            paragraphs, is_body = [], False
+        if tag in (_PPTX_NS_A + "p", _PPTX_NS_P + "sp"):
+            elem.clear()
+    return ""
+
+def _read_shapes_text(stream) -> str:
+    """
+    Texto de las formas de una diapositiva (como `extract_slides_content`):
+    el texto de cada forma o tabla con sus párrafos separados por saltos de
+    línea, sin espacios en los extremos, y las formas unidas por espacios.
+    """
+    shapes, paragraphs, runs = [], [], []
+    for _, elem in ET.iterparse(stream):
+        tag = elem.tag
+        if tag == _PPTX_NS_A + "t":
+            runs.append(elem.text or "")
+        elif tag == _PPTX_NS_A + "br":
+            runs.append("\v")
+        elif tag == _PPTX_NS_A + "p":
+            paragraphs.append("".join(runs))
+            runs = []
+        elif tag in (_PPTX_NS_P + "sp", _PPTX_NS_P + "graphicFrame"):
+            text = "\n".join(paragraphs).strip()
+            if text:
+                shapes.append(text)
+            paragraphs = []
+        if tag in (_PPTX_NS_A + "p", _PPTX_NS_P + "sp", _PPTX_NS_P + "graphicFrame"):
+            elem.clear()
+    return " ".join(shapes)
+
+def _pptx_slide_parts(archive: zipfile.ZipFile) -> List[str]:
+    """Partes `ppt/slides/*.xml` en el orden de presentación de `ppt/presentation.xml`."""
+    presentation_part = "ppt/presentation.xml"
+    presentation_rels = _read_pptx_rels(archive, presentation_part)
+    slide_parts = []
+    with archive.open(presentation_part) as stream:
+        for _, elem in ET.iterparse(stream):
+            if elem.tag == _PPTX_NS_P + "sldId":
+                slide_parts.append(presentation_rels[elem.get(_PPTX_NS_R + "id")][1])
+            elif elem.tag == _PPTX_NS_P + "sldIdLst":
+                break
+    return slide_parts
+
+def read_pptx_slide_text(source) -> List[str]:
+    """
+    Lee el texto de las formas de cada diapositiva de un PPTX analizando en
+    streaming `ppt/slides/*.xml`. Devuelve un texto por diapositiva, en orden.
+    """
+    with zipfile.ZipFile(source) as archive:
+        texts = []
+        for slide_part in _pptx_slide_parts(archive):
+            with archive.open(slide_part) as stream:
+                texts.append(_read_shapes_text(stream))
+        return texts
+
+def read_pptx_notes(source) -> List[str]:
+    """
+    Lee las notas del orador de un PPTX (ruta, bytes en BytesIO o fichero)
+    sin construir el modelo de objetos de python-pptx: recorre el orden de
+    diapositivas de `ppt/presentation.xml` y analiza en streaming solo los
+    `ppt/notesSlides/*.xml` enlazados. Devuelve una nota (sin espacios en los
+    extremos, "" si no tiene) por diapositiva, en orden.
+    """
+    with zipfile.ZipFile(source) as archive:
+        notes = []
+        for slide_part in _pptx_slide_parts(archive):
+            note = ""
+            for rel_type, target in _read_pptx_rels(archive, slide_part).values():
+                if rel_type == _PPTX_NOTES_REL:
+                    with archive.open(target) as stream:
+                        note = _read_notes_text(stream).strip()
+                    break
+            notes.append(note)
+        return notes
+
 def reset_state():
     """Reinicia el estado de la aplicación y elimina archivos temporales"""
     import os  # in case not already imported
@@ -60,20 +191,36 @@ def reset_state():
         except Exception as e:
             st.error(f"Error al eliminar el video temporal: {e}")
             
+    # Eliminar el almacén de diapositivas y audios de la sesión
+    slide_store = st.session_state.get("slide_store")
+    if slide_store:
+        slide_store.close()
+
     keys_to_reset = [
         'step', 'uploaded_file', 'file_type', 'file_stats', 
         'generated_notes', 'target_language', 'tts_provider', 
         'generated_audio', 'video_options',
-        'slides_images', 'slides_notes', 'user_prompt', 
-        'vlm_model_url', 'vlm_model_id', 'slides_notes_audios', 
+        'slide_store', 'user_prompt', 
+        'vlm_model_url', 'vlm_model_id', 'upload_key', 
         'selected_voice', 'generated_video'
     ]
     for key in keys_to_reset:
         if key in st.session_state:
             del st.session_state[key]
 
+_session_stores_swept = False
+
 def init_session_state():
     """Inicializa las variables de estado necesarias"""
+    global _session_stores_swept
+    if not _session_stores_swept:
+        # Al arrancar el servidor se limpian los almacenes que dejaron las ejecuciones anteriores
+        _session_stores_swept = True
+        sweep_session_stores()
+    # Cada ejecución del script renueva el almacén de la sesión para que no se limpie mientras siga abierta
+    slide_store = st.session_state.get("slide_store")
+    if slide_store:
+        slide_store.touch()
     defaults = {
         'step': 0,
         'uploaded_file': None,
@@ -125,42 +272,154 @@ def extract_slides_content(presentation: Presentation) -> List[dict]:
     
     return slides_data
 
-def extract_pdf_slides(file):
+def get_page_matrix(page, target_height: int = DEFAULT_TARGET_HEIGHT) -> fitz.Matrix:
     """
-    Devuelve cada página como PNG con altura ≥ min_height (px).
+    Calcula la matriz de escalado de una página para que su raster mida
+    exactamente `target_height` píxeles de alto y un ancho par (lo que exige
+    yuv420p), respetando la proporción de la página.
     """
-    images = []
-    file.seek(0)
-    pdf_document = fitz.open(stream=file.read(), filetype="pdf")
+    rect = page.rect
+    height = target_height - target_height % 2
+    width = int(round(rect.width * height / rect.height))
+    width -= width % 2
+    return fitz.Matrix(width / rect.width, height / rect.height)
+
+def get_page_text_layer(page) -> dict:
+    """
+    Capa de texto de una página: su texto (`content`) y la cobertura de texto
+    (`text_coverage`), la fracción del área con contenido (bloques de texto,
+    imágenes y dibujos) que ocupa el texto. Las imágenes y dibujos que cubren
+    casi toda la página se tratan como fondo y no cuentan.
+    """
+    page_rect = page.rect
+    background_area = abs(page_rect) * TEXT_LAYER_BACKGROUND_RATIO
+    text_area, graphic_area, parts = 0.0, 0.0, []
+    for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks"):
+        if block_type == 0 and text.strip():
+            text_area += abs(fitz.Rect(x0, y0, x1, y1) & page_rect)
+            parts.append(text.strip())
+    graphic_rects = [fitz.Rect(info["bbox"]) for info in page.get_image_info()]
+    graphic_rects += [drawing["rect"] for drawing in page.get_drawings()]
+    for rect in graphic_rects:
+        area = abs(rect & page_rect)
+        if area < background_area:
+            graphic_area += area
+    coverage = text_area / (text_area + graphic_area) if text_area else 0.0
+    return {"content": "\n".join(parts), "text_coverage": round(coverage, 3)}
+
+def extract_text_layers(pdf_path: str, pptx_source=None) -> List[dict]:
+    """
+    Capas de texto de cada página de un PDF (ver `get_page_text_layer`), sin
+    rasterizar. Con `pptx_source` (el PPTX del que se generó el PDF), el
+    contenido de cada diapositiva con texto en sus formas es ese texto
+    (`read_pptx_slide_text`); la cobertura sigue saliendo del PDF.
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        text_layers = [get_page_text_layer(page) for page in pdf_document]
+    if pptx_source is not None:
+        for text_layer, shapes_text in zip(text_layers, read_pptx_slide_text(pptx_source)):
+            if shapes_text:
+                text_layer["content"] = shapes_text
+    return text_layers
+
+def ensure_text_layers(store: SlideStore, pptx_source=None) -> None:
+    """
+    Calcula y guarda en el almacén las capas de texto si aún no las tiene.
+    Solo las necesita el nivel de texto de las notas, así que no se extraen
+    al cargar la presentación sino la primera vez que se activa. Sin el PDF
+    de origen las diapositivas se quedan sin capa (todas irán por imagen).
+    """
+    if store.has_text_layers() or not store.source_pdf:
+        return
+    store.set_text_layers(extract_text_layers(store.source_pdf, pptx_source))
+
+def _rasterize_page_range(pdf_path: str, start: int, stop: int, target_height: int, out_dir: str) -> List[RawSlide]:
+    """
+    Rasteriza las páginas [start, stop) abriendo el PDF en el propio proceso.
+    Las muestras RGB de cada pixmap se vuelcan tal cual a `out_dir`, sin PNG.
+    """
+    pdf_document = fitz.open(pdf_path)
+    try:
+        slides = []
+        for page_number in range(start, stop):
+            page = pdf_document[page_number]
+            pix = page.get_pixmap(matrix=get_page_matrix(page, target_height), alpha=False)
+            slides.append(RawSlide.from_pixmap(pix, os.path.join(out_dir, f"slide_{page_number + 1:04d}.rgb")))
+        return slides
+    finally:
+        pdf_document.close()
+
+def rasterize_pdf(pdf_path: str, target_height: int = DEFAULT_TARGET_HEIGHT, workers: int = None, out_dir: str = None) -> List[RawSlide]:
+    """
+    Rasteriza un PDF en disco repartiendo el rango de páginas entre varios
+    procesos; cada uno abre su propio documento de PyMuPDF sobre el fichero.
+    Las diapositivas se devuelven en el orden de las páginas como `RawSlide`
+    (muestras crudas en `out_dir`, un directorio temporal si no se indica).
+    Con pocas páginas (o un solo proceso) se rasteriza en serie en el proceso actual.
+    """
+    out_dir = out_dir or tempfile.mkdtemp(prefix="slides2video_slides_")
+    with fitz.open(pdf_path) as pdf_document:
+        page_count = pdf_document.page_count
 
-    for page in pdf_document:
-        # calcula el dpi que asegura min_height pero sin pasar de dpi_max
-        pix = page.get_pixmap(dpi=300)
-        images.append(pix.tobytes("png"))
+    workers = min(workers or RASTER_WORKERS or os.cpu_count() or 1, page_count)
+    if workers <= 1 or page_count < RASTER_PARALLEL_MIN_PAGES:
+        return _rasterize_page_range(pdf_path, 0, page_count, target_height, out_dir)
 
-    pdf_document.close()
-    return images
+    # Bloques contiguos de páginas, uno por proceso
+    chunk = -(-page_count // workers)
+    ranges = [(start, min(start + chunk, page_count)) for start in range(0, page_count, chunk)]
+    slides = []
+    # spawn: hacer fork del servidor de Streamlit, con hilos (y quizá torch) activos, puede bloquear a los hijos
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(ranges), mp_context=context) as executor:
+        futures = [executor.submit(_rasterize_page_range, pdf_path, start, stop, target_height, out_dir) for start, stop in ranges]
+        for future in futures:
+            slides.extend(future.result())
+    return slides
 
-def extract_pptx_slides(uploaded_file):
+def extract_pdf_slides(file, target_height: int = DEFAULT_TARGET_HEIGHT, workers: int = None):
+    """
+    Devuelve cada página como `RawSlide` con altura `target_height` (px).
+    El PDF queda junto a las diapositivas (`SOURCE_PDF_NAME`) para extraer
+    su capa de texto solo si se llega a necesitar (ver `ensure_text_layers`).
+    """
+    file.seek(0)
+    out_dir = tempfile.mkdtemp(prefix="slides2video_slides_")
+    slides = []
+    try:
+        # Copia compartida por los procesos de rasterizado
+        pdf_path = os.path.join(out_dir, SOURCE_PDF_NAME)
+        with open(pdf_path, "wb") as f:
+            f.write(file.read())
+        slides = rasterize_pdf(pdf_path, target_height, workers, out_dir)
+        return slides
+    finally:
+        if not slides:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+def extract_pptx_slides(uploaded_file, target_height: int = DEFAULT_TARGET_HEIGHT, workers: int = None):
     """
     Extrae imágenes y notas de cada slide de un archivo PPTX.
     
     Las imágenes se obtienen convirtiendo el PPTX a PDF con pptx2pdfwasm
-    y extrayendo cada página del PDF en formato PNG.
-    Las notas se extraen utilizando python-pptx.
+    y rasterizando cada página del PDF (ver `rasterize_pdf`).
+    Las notas se extraen con `read_pptx_notes`. El PDF generado queda junto
+    a las diapositivas (`SOURCE_PDF_NAME`) para extraer su capa de texto
+    solo si se llega a necesitar (ver `ensure_text_layers`).
     
     Args:
         uploaded_file (BytesIO): Archivo PPTX subido.
-        min_height (int): Altura mínima de las imágenes en píxeles.
-        dpi_max (int): DPI máximo para la conversión de imágenes.
+        target_height (int): Altura de las imágenes en píxeles (la del vídeo de salida).
+        workers (int): Procesos para rasterizar el PDF generado.
     
     Returns:
-        Tuple[List[bytes], List[str]]: (lista de imágenes en bytes, lista de notas)
+        Tuple[List[RawSlide], List[str]]: (lista de diapositivas, lista de notas)
     """
     slides_images = []
     slides_notes = []
     pptx_path = None
     pdf_path = None
+    out_dir = tempfile.mkdtemp(prefix="slides2video_slides_")
 
     try:
         # Guardar el archivo PPTX en un archivo temporal
@@ -168,46 +427,34 @@ def extract_pptx_slides(uploaded_file):
             tmp.write(uploaded_file.read())
             pptx_path = tmp.name
         
-        # Asegurar que el archivo temporal se cierre antes de la conversión
-
-        if sys.platform.startswith('win') and sys.version_info >= (3, 8):
-            asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-        
-        # Convertir el PPTX a PDF usando pptx2pdfwasm
-        converter = PPTXtoPDFConverter(headless=True, log_enabled=True, port=7777)
-        converter.start_server()
-        try:
-            converter.convert(pptx_path, os.path.splitext(pptx_path)[0] + ".pdf")
-        finally:
-            converter.stop_server()
-
-        # Definir la ruta del PDF generado
+        # Convertir el PPTX a PDF con el pool de conversores pptx2pdfwasm ya arrancados
         pdf_path = os.path.splitext(pptx_path)[0] + ".pdf"
+        get_converter_pool().convert(pptx_path, pdf_path)
+
         if not os.path.exists(pdf_path):
             st.error(f"No se encontró el PDF generado con pptx2pdfwasm en: {pdf_path}")
             return [], []
 
-        # Abrir el PDF y extraer cada página como imagen PNG
-        doc = fitz.open(pdf_path)
-        for page in doc:
-            pix = page.get_pixmap(dpi=300)
-            slides_images.append(pix.tobytes("png"))
-        doc.close()
-
-        # Extraer las notas de cada slide usando python-pptx
-        prs = Presentation(pptx_path)
-        for slide in prs.slides:
-            notes = ""
-            if slide.has_notes_slide and slide.notes_slide.notes_text_frame is not None:
-                notes = slide.notes_slide.notes_text_frame.text.strip()
-            slides_notes.append(notes)
+        # Rasterizar cada página del PDF, que se conserva junto a las diapositivas
+        source_pdf = os.path.join(out_dir, SOURCE_PDF_NAME)
+        shutil.move(pdf_path, source_pdf)
+        slides_images = rasterize_pdf(source_pdf, target_height, workers, out_dir)
 
+        # Extraer las notas directamente del zip del PPTX
+        slides_notes = read_pptx_notes(pptx_path)
+
+    except TimeoutError as e:
+        st.error(f"⏱️ {e}. Vuelve a intentarlo más tarde o sube la presentación exportada a PDF.")
+        return [], []
     except Exception as e:
         st.error(f"Error al procesar el archivo PPTX: {e}")
+        slides_images = []
         return [], []
     finally:
         # Limpiar archivos temporales
         try:
+            if not slides_images:
+                shutil.rmtree(out_dir, ignore_errors=True)
             if pptx_path and os.path.exists(pptx_path):
                 os.unlink(pptx_path)
             if pdf_path and os.path.exists(pdf_path):
@@ -220,3 +467,44 @@ def extract_pptx_slides(uploaded_file):
 def get_file_bytes(file_path: str) -> bytes:
     with open(file_path, "rb") as f:
         return f.read()
+
+_upload_cache = OrderedDict()
+_upload_cache_lock = threading.Lock()
+
+def load_presentation(uploaded_file, file_type: str, target_height: int = DEFAULT_TARGET_HEIGHT, workers: int = None):
+    """
+    Obtiene estadísticas, diapositivas y notas de una presentación subida,
+    memorizando el resultado por el hash de su contenido y los ajustes de
+    rasterizado. Las recargas de Streamlit o una nueva subida del mismo
+    fichero se resuelven sin volver a procesarlo. La caché es LRU y está
+    limitada a UPLOAD_CACHE_MAX_ENTRIES presentaciones; al expulsar una se
+    borran sus diapositivas de disco (los almacenes de sesión usan enlaces).
+
+    Returns:
+        Tuple[str, dict, List[RawSlide], List[str]]: (clave, estadísticas, diapositivas, notas)
+    """
+    key = hash_content(uploaded_file.getvalue(), file_type, target_height)
+    with _upload_cache_lock:
+        if key in _upload_cache:
+            _upload_cache.move_to_end(key)
+            stats, slides, notes = _upload_cache[key]
+            return key, stats, slides, notes
+
+    stats = get_file_stats(file_type, uploaded_file)
+    if not stats:
+        return key, None, [], []
+    if file_type == 'pdf':
+        slides = extract_pdf_slides(uploaded_file, target_height, workers)
+        notes = ["" for _ in slides]
+    else:
+        slides, notes = extract_pptx_slides(uploaded_file, target_height, workers)
+    if not slides:
+        return key, stats, slides, notes
+
+    with _upload_cache_lock:
+        _upload_cache[key] = (stats, slides, notes)
+        _upload_cache.move_to_end(key)
+        while len(_upload_cache) > UPLOAD_CACHE_MAX_ENTRIES:
+            _, (_, evicted_slides, _) = _upload_cache.popitem(last=False)
+            release_slides(evicted_slides)
+    return key, stats, slides, notes
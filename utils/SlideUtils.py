@@ -0,0 +1,426 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+
+"""
+Módulo: SlideUtils.py
+
+Representación interna de las diapositivas rasterizadas. Cada diapositiva se
+guarda como muestras RGB crudas en un fichero en disco y se accede a ella con
+una vista de NumPy mapeada en memoria, sin pasar por PNG. La codificación a
+PNG/JPEG solo se hace cuando un consumidor necesita bytes comprimidos (subida
+al VLM o miniatura en la interfaz) y se memoriza. Para el VLM la imagen se
+reduce a la resolución de visión del modelo y se codifica por debajo de un
+presupuesto de bytes (`encode_payload`).
+
+`SlideStore` agrupa las diapositivas, capas de texto, audios y notas de una sesión en un
+directorio local con un índice, para no guardar binarios en `st.session_state`.
+"""
+
+# Directorio raíz de los almacenes de sesión
+SESSION_STORE_ROOT = os.path.join(tempfile.gettempdir(), "slides2video_sessions")
+# Los almacenes sin uso durante más de este tiempo (horas) se consideran abandonados
+SESSION_STORE_TTL = float(os.environ.get("SLIDES2VIDEO_SESSION_TTL_HOURS", "24")) * 3600
+# Tamaño máximo de todos los almacenes de sesión juntos (MB); por encima no se admiten subidas nuevas
+SESSION_STORE_MAX_BYTES = int(os.environ.get("SLIDES2VIDEO_SESSION_STORE_MB", "8192")) * 1024 * 1024
+# PDF de origen que se conserva junto a las diapositivas rasterizadas (para extraer su texto bajo demanda)
+SOURCE_PDF_NAME = "source.pdf"
+
+PAYLOAD_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+# Calidades que se prueban, de mayor a menor, antes de reducir la resolución
+PAYLOAD_QUALITIES = (85, 75, 65, 50)
+# Lado menor por debajo del cual ya no se reduce más la imagen para cumplir el presupuesto
+PAYLOAD_MIN_SIDE = 360
+
+
+class RawSlide:
+    """Diapositiva rasterizada como fichero de muestras RGB (alto x ancho x canales)."""
+
+    def __init__(self, path: str, width: int, height: int, channels: int = 3) -> None:
+        self.path = path
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self._array = None
+        self._encoded = {}
+
+    @classmethod
+    def from_pixmap(cls, pix, path: str) -> "RawSlide":
+        """Vuelca las muestras de un pixmap de PyMuPDF a disco sin codificarlas."""
+        samples = pix.samples_mv if hasattr(pix, "samples_mv") else pix.samples
+        with open(path, "wb") as f:
+            f.write(samples)
+        return cls(path, pix.width, pix.height, pix.n)
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @property
+    def array(self) -> np.ndarray:
+        """Vista de solo lectura (memmap) sobre las muestras de la diapositiva."""
+        if self._array is None:
+            self._array = np.memmap(self.path, dtype=np.uint8, mode="r", shape=(self.height, self.width, self.channels))
+        return self._array
+
+    def to_image(self) -> Image.Image:
+        return Image.fromarray(self.array)
+
+    def to_bytes(self, format: str = "PNG", max_height: int = None, quality: int = 90) -> bytes:
+        """Codifica la diapositiva (opcionalmente reducida a `max_height`) y memoriza el resultado."""
+        key = (format.upper(), max_height, quality)
+        if key not in self._encoded:
+            image = self.to_image()
+            if max_height and image.height > max_height:
+                image = image.resize((round(image.width * max_height / image.height), max_height), Image.LANCZOS)
+            output = io.BytesIO()
+            if key[0] in ("JPEG", "WEBP"):
+                image.save(output, format=key[0], quality=quality)
+            else:
+                image.save(output, format=key[0], compress_level=1)
+            self._encoded[key] = output.getvalue()
+        return self._encoded[key]
+
+    def cached_bytes(self, format: str = "PNG", max_height: int = None, quality: int = 90):
+        """Lo que devolvería `to_bytes` si ya está memorizado; None sin codificar nada si no."""
+        return self._encoded.get((format.upper(), max_height, quality))
+
+    def thumbnail(self, max_height: int = 540) -> bytes:
+        """Miniatura JPEG para la previsualización en la interfaz."""
+        return self.to_bytes("JPEG", max_height=max_height, quality=85)
+
+    def __getstate__(self):
+        # Al enviarla a otro proceso solo viaja la ruta; el receptor vuelve a mapear el fichero
+        state = self.__dict__.copy()
+        state["_array"] = None
+        state["_encoded"] = {}
+        return state
+
+
+def slide_to_bytes(image_obj, format: str = "PNG") -> bytes:
+    """Bytes comprimidos de una diapositiva (RawSlide, binario, fichero subido o ruta)."""
+    if isinstance(image_obj, RawSlide):
+        return image_obj.to_bytes(format)
+    if hasattr(image_obj, "getvalue"):
+        return image_obj.getvalue()
+    if isinstance(image_obj, bytes):
+        return image_obj
+    with open(image_obj, "rb") as image_file:
+        return image_file.read()
+
+
+def source_size(image_obj) -> int:
+    """
+    Tamaño de la diapositiva original sin codificar nada: las muestras crudas
+    de una RawSlide o los bytes del binario, fichero subido o ruta.
+    """
+    if isinstance(image_obj, RawSlide):
+        return image_obj.width * image_obj.height * image_obj.channels
+    if hasattr(image_obj, "getvalue"):
+        return len(image_obj.getvalue())
+    if isinstance(image_obj, bytes):
+        return len(image_obj)
+    return os.path.getsize(image_obj)
+
+
+def image_mime_type(data: bytes) -> str:
+    """Tipo MIME de una imagen codificada a partir de su firma."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "application/octet-stream"
+
+
+def _encode_image(image: Image.Image, format: str, quality: int) -> bytes:
+    output = io.BytesIO()
+    if format == "PNG":
+        image.save(output, format=format, optimize=True)
+    else:
+        image.save(output, format=format, quality=quality)
+    return output.getvalue()
+
+
+def _payload_key(format: str, max_side: int, max_bytes: int) -> tuple:
+    return ("payload", format.upper(), max_side, max_bytes)
+
+
+def cached_payload(image_obj, max_side: int = None, max_bytes: int = None, format: str = "JPEG"):
+    """Payload que `encode_payload` ya memorizó en la RawSlide para estos ajustes, o None (no codifica)."""
+    if isinstance(image_obj, RawSlide):
+        return image_obj._encoded.get(_payload_key(format, max_side, max_bytes))
+    return None
+
+
+def encode_payload(image_obj, max_side: int = None, max_bytes: int = None, format: str = "JPEG"):
+    """
+    Codifica una diapositiva para enviarla a un modelo de visión: la reduce
+    para que su lado mayor no supere `max_side` y baja la calidad (y, si no
+    basta, la resolución) hasta quedar por debajo de `max_bytes`. Devuelve
+    (bytes, tipo MIME); para RawSlide el resultado se memoriza.
+    """
+    format = format.upper()
+    key = _payload_key(format, max_side, max_bytes)
+    if isinstance(image_obj, RawSlide) and key in image_obj._encoded:
+        return image_obj._encoded[key], PAYLOAD_MIME_TYPES[format]
+
+    image = slide_to_image(image_obj)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    if max_side and max(image.size) > max_side:
+        scale = max_side / max(image.size)
+        image = image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+
+    # En PNG (sin pérdida) solo se puede reducir la resolución
+    qualities = (None,) if format == "PNG" else PAYLOAD_QUALITIES
+    data = None
+    while data is None:
+        for quality in qualities:
+            candidate = _encode_image(image, format, quality)
+            if not max_bytes or len(candidate) <= max_bytes:
+                data = candidate
+                break
+        else:
+            if min(image.size) <= PAYLOAD_MIN_SIDE:
+                # No se reduce más para no perder la legibilidad del texto
+                data = candidate
+            else:
+                image = image.resize((round(image.width * 0.8), round(image.height * 0.8)), Image.LANCZOS)
+
+    if isinstance(image_obj, RawSlide):
+        image_obj._encoded[key] = data
+    return data, PAYLOAD_MIME_TYPES[format]
+
+
+def slide_to_image(image_obj) -> Image.Image:
+    """Imagen PIL de una diapositiva; para RawSlide no se decodifica ningún PNG."""
+    if isinstance(image_obj, RawSlide):
+        return image_obj.to_image()
+    if isinstance(image_obj, Image.Image):
+        return image_obj
+    if isinstance(image_obj, bytes):
+        return Image.open(io.BytesIO(image_obj))
+    if isinstance(image_obj, np.ndarray):
+        return Image.fromarray(image_obj)
+    return Image.open(image_obj)
+
+
+def release_slides(slides) -> None:
+    """Elimina del disco los directorios que contienen las diapositivas dadas."""
+    for directory in {os.path.dirname(slide.path) for slide in slides or [] if isinstance(slide, RawSlide)}:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _transfer_file(source: str, path: str, link: bool) -> None:
+    """Mueve `source` a `path` o, con `link`, lo enlaza (copiándolo si no se puede enlazar)."""
+    if link:
+        try:
+            os.link(source, path)
+        except OSError:
+            shutil.copyfile(source, path)
+    else:
+        shutil.move(source, path)
+
+
+def _directory_size(directory: str) -> int:
+    total = 0
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False):
+                total += entry.stat().st_size
+    return total
+
+
+def sweep_session_stores(keep: str = None, max_age: float = SESSION_STORE_TTL) -> int:
+    """
+    Elimina los almacenes de sesión abandonados (pestaña cerrada, reinicio
+    del servidor): los que llevan más de `max_age` segundos sin usarse. El
+    uso se mide por la fecha de `index.json`, que se reescribe en cada
+    cambio y que `SlideStore.touch` renueva en cada ejecución de la sesión.
+    Los almacenes en uso nunca se eliminan, tampoco el almacén `keep`.
+    Devuelve los bytes que ocupan los almacenes que quedan (sin contar `keep`).
+    """
+    if not os.path.isdir(SESSION_STORE_ROOT):
+        return 0
+    now = time.time()
+    total = 0
+    with os.scandir(SESSION_STORE_ROOT) as it:
+        for entry in it:
+            if not entry.is_dir(follow_symlinks=False) or entry.path == keep:
+                continue
+            index_path = os.path.join(entry.path, "index.json")
+            try:
+                last_used = os.path.getmtime(index_path if os.path.exists(index_path) else entry.path)
+                size = _directory_size(entry.path)
+            except OSError:
+                continue
+            if now - last_used > max_age:
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                total += size
+    return total
+
+
+def session_stores_over_budget(max_bytes: int = SESSION_STORE_MAX_BYTES) -> bool:
+    """
+    Limpia los almacenes abandonados e indica si los que siguen en uso
+    superan `max_bytes`; en ese caso no se debe crear uno nuevo.
+    """
+    return sweep_session_stores() > max_bytes
+
+
+class SlideStore:
+    """
+    Almacén en disco de una sesión: índice nº de diapositiva → imagen, audio y nota.
+
+    Las imágenes son `RawSlide` mapeadas en memoria bajo demanda y los audios se
+    guardan como ficheros, de modo que en la sesión solo vive este objeto ligero.
+    El índice se persiste en `index.json` dentro del directorio del almacén.
+    """
+
+    def __init__(self, directory: str = None) -> None:
+        os.makedirs(SESSION_STORE_ROOT, exist_ok=True)
+        if directory is None:
+            self.directory = tempfile.mkdtemp(prefix="store_", dir=SESSION_STORE_ROOT)
+        else:
+            self.directory = directory
+        self._index = []
+        self._slides = []
+        index_path = os.path.join(self.directory, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path, encoding="utf-8") as f:
+                self._index = json.load(f)
+            self._slides = [self._load_slide(entry["image"]) for entry in self._index]
+
+    @classmethod
+    def from_slides(cls, slides, notes, link: bool = False, text_layers=None) -> "SlideStore":
+        """
+        Crea un almacén con las diapositivas, notas y capas de texto dadas. Los
+        ficheros de las diapositivas (y el PDF de origen que las acompañe) se
+        mueven al almacén o, con `link`, se enlazan (sin copiar) para que el
+        origen pueda seguir usándose.
+        """
+        store = cls()
+        text_layers = text_layers or []
+        if slides:
+            source_pdf = os.path.join(os.path.dirname(slides[0].path), SOURCE_PDF_NAME)
+            if os.path.exists(source_pdf):
+                _transfer_file(source_pdf, os.path.join(store.directory, SOURCE_PDF_NAME), link)
+        for number, slide in enumerate(slides, 1):
+            note = notes[number - 1] if number - 1 < len(notes) else ""
+            text_layer = text_layers[number - 1] if number - 1 < len(text_layers) else None
+            path = os.path.join(store.directory, f"slide_{number:04d}.rgb")
+            _transfer_file(slide.path, path, link)
+            image = {"file": os.path.basename(path), "width": slide.width, "height": slide.height, "channels": slide.channels}
+            store._index.append({"image": image, "text": text_layer, "audio": None, "note": note or ""})
+            store._slides.append(store._load_slide(image))
+        if not link:
+            release_slides(slides)
+        store._save()
+        return store
+
+    def _load_slide(self, image: dict) -> RawSlide:
+        return RawSlide(os.path.join(self.directory, image["file"]), image["width"], image["height"], image["channels"])
+
+    def _save(self) -> None:
+        index_path = os.path.join(self.directory, "index.json")
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(index_path + ".tmp", index_path)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    # Imágenes
+    def image(self, idx: int) -> RawSlide:
+        return self._slides[idx]
+
+    def images(self):
+        return list(self._slides)
+
+    # Capas de texto
+    def text_layer(self, idx: int) -> dict:
+        """
+        Texto y cobertura de texto de la diapositiva, con la forma de
+        `extract_slides_content` (`slide_num`, `content`) más `text_coverage`.
+        """
+        text = self._index[idx].get("text") or {}
+        return {"slide_num": idx + 1, "content": text.get("content", ""), "text_coverage": text.get("text_coverage", 0.0)}
+
+    def text_layers(self):
+        return [self.text_layer(idx) for idx in range(len(self))]
+
+    def has_text_layers(self) -> bool:
+        return all(entry.get("text") is not None for entry in self._index)
+
+    def set_text_layers(self, text_layers) -> None:
+        for entry, text_layer in zip(self._index, text_layers):
+            entry["text"] = text_layer
+        self._save()
+
+    @property
+    def source_pdf(self):
+        """Ruta del PDF del que se rasterizaron las diapositivas o None si no se conserva."""
+        path = os.path.join(self.directory, SOURCE_PDF_NAME)
+        return path if os.path.exists(path) else None
+
+    # Notas
+    def note(self, idx: int) -> str:
+        return self._index[idx]["note"]
+
+    def notes(self):
+        return [entry["note"] for entry in self._index]
+
+    def set_note(self, idx: int, note: str) -> None:
+        if self._index[idx]["note"] != note:
+            self._index[idx]["note"] = note
+            self._save()
+
+    def set_notes(self, notes) -> None:
+        for entry, note in zip(self._index, notes):
+            entry["note"] = note
+        self._save()
+
+    # Audios
+    def audio(self, idx: int):
+        """Ruta del audio de la diapositiva o None si no tiene."""
+        name = self._index[idx]["audio"]
+        return os.path.join(self.directory, name) if name else None
+
+    def audios(self):
+        return [self.audio(idx) for idx in range(len(self))]
+
+    def set_audio(self, idx: int, data: bytes) -> None:
+        """Guarda el audio (WAV o MP3) de la diapositiva; un binario vacío lo elimina."""
+        old_path = self.audio(idx)
+        if old_path and os.path.exists(old_path):
+            os.remove(old_path)
+        name = None
+        if data:
+            extension = ".wav" if data[:4] == b"RIFF" else ".mp3"
+            # Nombre con versión para que la interfaz no muestre un audio anterior en caché
+            name = f"audio_{idx + 1:04d}_{os.urandom(4).hex()}{extension}"
+            with open(os.path.join(self.directory, name), "wb") as f:
+                f.write(data)
+        self._index[idx]["audio"] = name
+        self._save()
+
+    def touch(self) -> None:
+        """Marca el almacén como en uso para que la limpieza no lo trate como abandonado."""
+        try:
+            os.utime(os.path.join(self.directory, "index.json"))
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        """Elimina el almacén del disco."""
+        shutil.rmtree(self.directory, ignore_errors=True)
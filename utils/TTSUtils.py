@@ -1,17 +1,137 @@
 # Esto necesita un refactor importante. La abstracción es un poco regulera
 import abc
 import io
+import logging
 import numpy as np
 import soundfile as sf
 import torch
 import torchaudio as ta
 from TTS.api import TTS
+import multiprocessing
 import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Tuple
+from utils.CacheUtils import DiskCache, get_cache_dir, hash_content, hash_file
+from utils.TextUtils import chunk_sentences, normalize_text
 
 os.environ["COQUI_TOS_AGREED"] = "1"
 
+logger = logging.getLogger(__name__)
+
+# Caché en disco de audios sintetizados (tamaño máximo en MB), compartida entre sesiones
+TTS_CACHE_MAX_BYTES = int(os.environ.get("SLIDES2VIDEO_TTS_CACHE_MB", "1024")) * 1024 * 1024
+_tts_cache = None
+
+# ElevenLabs: peticiones simultáneas (y conexiones del pool HTTP), URL de la API
+# (None = la del SDK; permite apuntar a un servidor compatible local) y reintentos
+ELEVENLABS_CONCURRENCY = int(os.environ.get("SLIDES2VIDEO_ELEVENLABS_CONCURRENCY", "4"))
+ELEVENLABS_BASE_URL = os.environ.get("SLIDES2VIDEO_ELEVENLABS_BASE_URL") or None
+ELEVENLABS_TIMEOUT = 120.0
+ELEVENLABS_RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Frecuencia de muestreo de salida de XTTSv2
+XTTS_SAMPLE_RATE = 24000
+# Límite de caracteres por fragmento si el tokenizador no define uno para el idioma
+XTTS_DEFAULT_CHAR_LIMIT = 250
+# Duración del fundido cruzado entre fragmentos sintetizados (ms)
+XTTS_CROSSFADE_MS = 40
+# Ajuste de XTTSv2 en CPU: hilos intra-op e inter-op (0 = los de PyTorch) y cuantización int8
+XTTS_CPU_THREADS = int(os.environ.get("SLIDES2VIDEO_XTTS_THREADS", "0"))
+XTTS_INTEROP_THREADS = int(os.environ.get("SLIDES2VIDEO_XTTS_INTEROP_THREADS", "0"))
+XTTS_QUANTIZE = os.environ.get("SLIDES2VIDEO_XTTS_QUANTIZE", "0") == "1"
+
+
+def get_tts_cache() -> DiskCache:
+    """Caché de audios compartida por todos los motores TTS del proceso."""
+    global _tts_cache
+    if _tts_cache is None:
+        _tts_cache = DiskCache("tts", max_bytes=TTS_CACHE_MAX_BYTES)
+    return _tts_cache
+
+
+def _reference_audio_hash(reference_audio) -> str:
+    """Hash del audio de referencia (ruta o fichero subido) para la clave de caché."""
+    if reference_audio is None:
+        return None
+    if hasattr(reference_audio, "getvalue"):
+        return hash_content(reference_audio.getvalue())
+    return hash_file(reference_audio)
+
+
+def crossfade_concat(chunks: List[np.ndarray], sample_rate: int, fade_ms: float = XTTS_CROSSFADE_MS) -> np.ndarray:
+    """
+    Une formas de onda mono con un fundido cruzado de potencia constante de
+    `fade_ms` en cada unión (acotado a la longitud del fragmento más corto),
+    escribiendo sobre un único array de salida.
+    """
+    chunks = [np.asarray(chunk, dtype=np.float32).reshape(-1) for chunk in chunks if len(chunk)]
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    fade = min(int(sample_rate * fade_ms / 1000), *(len(chunk) for chunk in chunks))
+    output = np.empty(sum(len(chunk) for chunk in chunks) - fade * (len(chunks) - 1), dtype=np.float32)
+    angle = np.linspace(0.0, np.pi / 2, fade, dtype=np.float32)
+    fade_in, fade_out = np.sin(angle), np.cos(angle)
+
+    output[:len(chunks[0])] = chunks[0]
+    position = len(chunks[0])
+    for chunk in chunks[1:]:
+        start = position - fade
+        output[start:position] = output[start:position] * fade_out + chunk[:fade] * fade_in
+        output[position:position + len(chunk) - fade] = chunk[fade:]
+        position += len(chunk) - fade
+    return output
+
+
+def configure_cpu_threads(threads: int = 0, interop_threads: int = 0) -> None:
+    """
+    Fija los hilos intra-op e inter-op de PyTorch (0 = no cambiar). Los
+    inter-op solo pueden fijarse antes del primer trabajo en paralelo.
+    """
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads and torch.get_num_interop_threads() != interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            logger.warning(f"No se pudieron fijar los hilos inter-op: {e}")
+
+
+def _conv1d_to_linear(module: torch.nn.Module) -> None:
+    """Sustituye las `Conv1D` de transformers (lineales con pesos traspuestos) por nn.Linear equivalentes."""
+    from transformers.pytorch_utils import Conv1D
+
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+
+
+def quantize_linear_layers(module: torch.nn.Module) -> torch.nn.Module:
+    """
+    Cuantización dinámica int8 (solo CPU) de las capas lineales del módulo.
+    Los bloques GPT-2 de XTTS usan `Conv1D` de transformers, que se pasan
+    antes a nn.Linear para que también se cuanticen.
+    """
+    _conv1d_to_linear(module)
+    return torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
 # Nueva interfaz/TTS engine base
 class TTSEngine(abc.ABC):
+    # Modelo y formato de salida por defecto, parte de la clave de la caché de audio
+    default_model_id = None
+    default_format = "wav_24000"
+
     @abc.abstractmethod
     def get_available_voices(self) -> dict:
         pass
@@ -20,17 +140,97 @@ class TTSEngine(abc.ABC):
     def synthesize_text(self, voice_id: str, text: str, **kwargs) -> bytes:
         pass
 
+    def _cache_params(self, **kwargs) -> dict:
+        """Parámetros que, junto con la voz, el idioma y el texto, determinan el audio."""
+        return {
+            "model": kwargs.get("model_id") or self.default_model_id or type(self).__name__,
+            "format": kwargs.get("format") or self.default_format,
+        }
+
+    def cache_key(self, voice_id: str, text: str, **kwargs) -> str:
+        return hash_content(
+            type(self).__name__,
+            voice_id,
+            kwargs.get("language"),
+            self._cache_params(**kwargs),
+            normalize_text(text),
+        )
+
+    def synthesize(self, voice_id: str, text: str, use_cache: bool = True, **kwargs) -> bytes:
+        """
+        `synthesize_text` con caché en disco: un texto ya sintetizado con el
+        mismo proveedor, modelo, voz, idioma y formato (comparado tras
+        normalizarlo) se devuelve sin volver a generarlo. Los fallos (audio
+        vacío) no se guardan.
+        """
+        if not text.strip():
+            return b""
+        key = None
+        if use_cache:
+            key = self.cache_key(voice_id, text, **kwargs)
+            cached = get_tts_cache().get(key)
+            if cached is not None:
+                return cached
+        audio = self.synthesize_text(voice_id, text, **kwargs)
+        if key and audio:
+            get_tts_cache().put(key, audio)
+        return audio
+
+    def synthesize_many(
+        self,
+        voice_id: str,
+        texts: List[str],
+        progress_callback: Callable[[int, int, int], None] = None,
+        use_cache: bool = True,
+        **kwargs
+    ) -> List[bytes]:
+        """
+        Sintetiza varios textos en orden con `synthesize`. Los textos vacíos
+        dan b"" y `progress_callback` (completados, total, índice) se llama
+        tras cada uno.
+        """
+        audios = []
+        for idx, text in enumerate(texts):
+            audios.append(self.synthesize(voice_id, text, use_cache=use_cache, **kwargs))
+            if progress_callback:
+                progress_callback(idx + 1, len(texts), idx)
+        return audios
+
+
+def tts_cache_stats() -> dict:
+    """Aciertos y fallos de la caché de audio en este proceso."""
+    return get_tts_cache().stats()
+
 # Implementación existente adaptada para cumplir con la interfaz
 class ElevenLabsTTS(TTSEngine):
+    """
+    ElevenLabs sobre un único `httpx.Client` con pool de conexiones, que
+    comparten todas las peticiones. `synthesize_many` sintetiza varias notas
+    a la vez (como mucho `max_workers`) y reintenta con backoff exponencial
+    las respuestas de límite de peticiones (429) y los errores 5xx.
+    """
     _instance = None
+    default_model_id = "eleven_multilingual_v2"
+    default_format = "mp3_44100_128"
+    max_retries = 5
+    backoff_base = 1.0
 
-    def __new__(cls, api_key: str):
-        if cls._instance is None or cls._instance.api_key != api_key:
+    def __new__(cls, api_key: str, base_url: str = ELEVENLABS_BASE_URL, max_workers: int = ELEVENLABS_CONCURRENCY):
+        max_workers = max(1, max_workers)
+        settings = (api_key, base_url, max_workers)
+        if cls._instance is None or (cls._instance.api_key, cls._instance.base_url, cls._instance.max_workers) != settings:
             cls._instance = super(ElevenLabsTTS, cls).__new__(cls)
             cls._instance.api_key = api_key
+            cls._instance.base_url = base_url
+            cls._instance.max_workers = max_workers
+            import httpx
             from elevenlabs.client import ElevenLabs  # Ajuste a la importación local
-            cls._instance.client = ElevenLabs(api_key=api_key)
-
+            cls._instance.http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers),
+                timeout=ELEVENLABS_TIMEOUT,
+            )
+            client_options = {"base_url": base_url} if base_url else {}
+            cls._instance.client = ElevenLabs(api_key=api_key, httpx_client=cls._instance.http_client, **client_options)
         return cls._instance
 
     def get_available_voices(self) -> dict:
@@ -45,24 +245,89 @@ class ElevenLabsTTS(TTSEngine):
         except Exception as e:
             return {}
 
-    def synthesize_text(self, voice_id: str, text: str, format="mp3_44100_128", model_id="eleven_multilingual_v2", **kwargs) -> bytes:
+    def _convert_with_retry(self, voice_id: str, text: str, model_id: str, output_format: str) -> bytes:
+        for attempt in range(self.max_retries + 1):
+            try:
+                # La respuesta llega en streaming: los errores pueden saltar al consumirla.
+                # Los reintentos se gestionan aquí, no en el SDK
+                return b"".join(self.client.text_to_speech.convert(
+                    text=text,
+                    voice_id=voice_id,
+                    model_id=model_id,
+                    output_format=output_format,
+                    request_options={"max_retries": 0},
+                ))
+            except Exception as e:
+                status = getattr(e, "status_code", None)
+                if attempt == self.max_retries or status not in ELEVENLABS_RETRYABLE_STATUS_CODES:
+                    raise
+                delay = self.backoff_base * 2 ** attempt + random.uniform(0, self.backoff_base)
+                logger.warning(f"ElevenLabs respondió {status}, reintentando en {delay:.1f}s")
+                time.sleep(delay)
+
+    def synthesize_text(self, voice_id: str, text: str, format=None, model_id=None, **kwargs) -> bytes:
         try:
-            audio_generator = self.client.text_to_speech.convert(
-                text=text,
-                voice_id=voice_id,
-                model_id=model_id,
-                output_format=format
+            return self._convert_with_retry(
+                voice_id, text, model_id or self.default_model_id, format or self.default_format
             )
-            return b"".join(audio_generator)
         except Exception as e:
+            logger.error(f"Error al sintetizar texto con ElevenLabs: {e}")
             return b""
 
+    def synthesize_many(
+        self,
+        voice_id: str,
+        texts: List[str],
+        progress_callback: Callable[[int, int, int], None] = None,
+        use_cache: bool = True,
+        **kwargs
+    ) -> List[bytes]:
+        """
+        Sintetiza los textos con como mucho `max_workers` peticiones a la vez.
+        Los audios se devuelven en el orden de los textos y `progress_callback`
+        (completados, total, índice) se llama desde el hilo que llama según
+        termina cada uno.
+        """
+        audios = [b""] * len(texts)
+        if not texts:
+            return audios
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.synthesize, voice_id, text, use_cache, **kwargs): idx
+                for idx, text in enumerate(texts)
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                idx = futures[future]
+                audios[idx] = future.result()
+                if progress_callback:
+                    progress_callback(done, len(texts), idx)
+        return audios
+
 class XTTSv2(TTSEngine):
+    """
+    XTTSv2 con las latentes de condicionamiento de cada voz calculadas una
+    sola vez. Las voces incluidas ya traen sus latentes en el speaker manager
+    del modelo; las de un audio de referencia (voz clonada) se calculan con
+    `get_conditioning_latents` y se guardan con `torch.save` en la caché
+    `xtts_latents`, por el hash del audio. La síntesis llama directamente a
+    `inference` con esas latentes, por fragmentos de frases que respetan el
+    límite de caracteres del idioma, y une el audio con fundidos cruzados.
+
+    En CPU admite un modo ajustado: hilos intra-op/inter-op explícitos y,
+    opcionalmente, cuantización dinámica int8 de las capas lineales del GPT.
+    """
     _instance = None
+    default_model_id = "tts_models/multilingual/multi-dataset/xtts_v2"
 
-    def __new__(cls):
-        if cls._instance is None:
+    def __new__(cls, cpu_threads: int = None, interop_threads: int = None, quantize: bool = None):
+        config = (
+            XTTS_CPU_THREADS if cpu_threads is None else cpu_threads,
+            XTTS_INTEROP_THREADS if interop_threads is None else interop_threads,
+            XTTS_QUANTIZE if quantize is None else quantize,
+        )
+        if cls._instance is None or cls._instance.config != config:
             cls._instance = super(XTTSv2, cls).__new__(cls)
+            cls._instance.config = config
             cls._instance.voices = [
                 "Aaron Dreschner", "Abrahan Mack", "Adde Michal", "Alexandra Hisakawa", "Alison Dietlinde",
                 "Alma María", "Ana Florence", "Andrew Chipper", "Annmarie Nele", "Asya Anara", "Badr Odhiambo",
@@ -83,7 +348,18 @@ class XTTSv2(TTSEngine):
                 "ko": "Korean", "hi": "Hindi"
             }
             cls._instance.device = "cuda" if torch.cuda.is_available() else "cpu"
-            cls._instance.model = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(cls._instance.device)
+            cls._instance.quantized = False
+            if cls._instance.device == "cpu":
+                configure_cpu_threads(config[0], config[1])
+            cls._instance.model = TTS(cls.default_model_id).to(cls._instance.device)
+            cls._instance.tts_model = cls._instance.model.synthesizer.tts_model
+            cls._instance.tts_model.eval()
+            if cls._instance.device == "cpu" and config[2]:
+                # Los operadores cuantizados dinámicos solo existen en CPU
+                quantize_linear_layers(cls._instance.tts_model.gpt)
+                cls._instance.quantized = True
+            cls._instance.latents = {}
+            cls._instance.latents_lock = threading.Lock()
         return cls._instance
 
     def get_available_voices(self) -> dict:
@@ -92,17 +368,82 @@ class XTTSv2(TTSEngine):
     def get_available_languages(self) -> dict:
         return {lang: code for lang, code in self.language_codes.items()}
 
+    def _cache_params(self, **kwargs) -> dict:
+        # Con audio de referencia la voz es la clonada, no `voice_id`; el modelo cuantizado suena distinto
+        params = super()._cache_params(**kwargs)
+        params["reference"] = _reference_audio_hash(kwargs.get("reference_wav"))
+        params["quantized"] = self.quantized
+        return params
+
+    def _compute_reference_latents(self, reference_wav) -> Tuple[torch.Tensor, torch.Tensor]:
+        # get_conditioning_latents carga el audio desde una ruta
+        if not hasattr(reference_wav, "getvalue"):
+            return self.tts_model.get_conditioning_latents(audio_path=[reference_wav])
+        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
+            tmp.write(reference_wav.getvalue())
+        try:
+            return self.tts_model.get_conditioning_latents(audio_path=[tmp.name])
+        finally:
+            os.unlink(tmp.name)
+
+    def get_speaker_latents(self, voice_id: str = None, reference_wav=None) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Latentes GPT y embedding de locutor de una voz incluida o de un audio
+        de referencia (ruta o fichero subido), memorizadas en el proceso y,
+        para las de referencia, persistidas en disco.
+        """
+        if reference_wav is None:
+            key = f"speaker:{voice_id}"
+        else:
+            key = f"reference:{_reference_audio_hash(reference_wav)}"
+        with self.latents_lock:
+            if key in self.latents:
+                return self.latents[key]
+            if reference_wav is None:
+                speaker = self.tts_model.speaker_manager.speakers[voice_id]
+                latents = (speaker["gpt_cond_latent"], speaker["speaker_embedding"])
+            else:
+                path = os.path.join(
+                    get_cache_dir("xtts_latents"), hash_content(self.default_model_id, key) + ".pt"
+                )
+                if os.path.exists(path):
+                    stored = torch.load(path, map_location=self.device)
+                    latents = (stored["gpt_cond_latent"], stored["speaker_embedding"])
+                else:
+                    with torch.inference_mode():
+                        latents = self._compute_reference_latents(reference_wav)
+                    torch.save(
+                        {"gpt_cond_latent": latents[0].cpu(), "speaker_embedding": latents[1].cpu()},
+                        path + ".tmp"
+                    )
+                    os.replace(path + ".tmp", path)
+            latents = tuple(latent.to(self.device) for latent in latents)
+            self.latents[key] = latents
+            return latents
+
+    def char_limit(self, language: str) -> int:
+        """Máximo de caracteres por entrada que admite el tokenizador de XTTS para el idioma."""
+        char_limits = getattr(self.tts_model.tokenizer, "char_limits", {})
+        return char_limits.get(language, char_limits.get(language.split("-")[0], XTTS_DEFAULT_CHAR_LIMIT))
+
     def synthesize_text(self, voice_id: str, text: str, **kwargs) -> bytes:
         try:
-            # TODO: Implementar referencia de voz
-            language = kwargs.get("reference_wav", None)
+            reference_wav = kwargs.get("reference_wav", None)
             language = kwargs.get("language", "es")
             # Log
             print(f"Sintetizando texto: '{text}' con voz: '{voice_id}' y lenguaje: '{language}'")
-            result = self.model.tts(text=text, speaker=voice_id, language=language)
-            audio = np.array(result)
+            gpt_cond_latent, speaker_embedding = self.get_speaker_latents(voice_id, reference_wav)
+            # Fragmentos cortos: decodificación autorregresiva más corta y sin truncar por el límite del idioma
+            waveforms = []
+            with torch.inference_mode():
+                for chunk in chunk_sentences(text, self.char_limit(language)):
+                    result = self.tts_model.inference(chunk, language, gpt_cond_latent, speaker_embedding)
+                    waveforms.append(np.asarray(result["wav"], dtype=np.float32))
+            if not waveforms:
+                return b""
+            audio = crossfade_concat(waveforms, XTTS_SAMPLE_RATE)
             with io.BytesIO() as output:
-                sf.write(output, audio, 24000, format='WAV')
+                sf.write(output, audio, XTTS_SAMPLE_RATE, format='WAV')
                 return output.getvalue()
         except Exception as e:
             print(f"Error al sintetizar texto: {e}")
@@ -124,6 +465,12 @@ class ChatterboxTTS(TTSEngine):
         # Aquí deberías implementar la lógica para obtener las voces disponibles
         return {"default": "Default Voice"}
 
+    def _cache_params(self, **kwargs) -> dict:
+        # La voz clonada depende del audio de referencia
+        params = super()._cache_params(**kwargs)
+        params["reference"] = _reference_audio_hash(self.reference_audio)
+        return params
+
     def synthesize_text(self, voice_id: str, text: str, **kwargs) -> bytes:
         try:
             if self.reference_audio is None:
@@ -191,6 +538,103 @@ class OuterTTSTTS(TTSEngine):
             print(f"Error al sintetizar texto con OuterTTS: {e}")
             return b""
 
+BENCHMARK_SENTENCES = [
+    "Bienvenidos a la clase de hoy.",
+    "En esta diapositiva vemos la arquitectura general del sistema y cómo se comunican sus componentes.",
+    "El algoritmo recorre la lista una sola vez, por lo que su coste es lineal en el número de elementos.",
+    "Para terminar, repasaremos las conclusiones principales y los próximos pasos del proyecto.",
+]
+
+XTTS_BENCHMARK_CONFIGS = {
+    "default": {"cpu_threads": 0, "interop_threads": 0, "quantize": False},
+    "threads": {"cpu_threads": os.cpu_count() or 1, "interop_threads": 1, "quantize": False},
+    "threads+int8": {"cpu_threads": os.cpu_count() or 1, "interop_threads": 1, "quantize": True},
+}
+
+
+def _peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB y macOS en bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _benchmark_xtts_config(config: dict, sentences: List[str], voice_id: str, language: str) -> dict:
+    engine = XTTSv2(**config)
+    engine.synthesize_text(voice_id, sentences[0], language=language)  # calentamiento
+    audio_seconds = 0.0
+    start = time.perf_counter()
+    for sentence in sentences:
+        audio = engine.synthesize_text(voice_id, sentence, language=language)
+        audio_seconds += sf.info(io.BytesIO(audio)).duration
+    elapsed = time.perf_counter() - start
+    return {
+        "seconds": elapsed,
+        "audio_seconds": audio_seconds,
+        "rtf": elapsed / audio_seconds if audio_seconds else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "threads": torch.get_num_threads(),
+        "quantized": engine.quantized,
+    }
+
+
+def benchmark_xtts(
+    configs: Dict[str, dict] = None,
+    sentences: List[str] = None,
+    voice_id: str = "Ana Florence",
+    language: str = "es",
+) -> Dict[str, dict]:
+    """
+    Mide XTTSv2 en CPU con cada configuración sobre un conjunto fijo de
+    frases (sin caché de audio). Cada configuración se ejecuta en un proceso
+    nuevo, de modo que los hilos y la memoria de pico no se contaminan entre
+    ellas. Devuelve, por configuración, el tiempo de síntesis tras un
+    calentamiento, la duración del audio, el factor de tiempo real (RTF) y la
+    memoria residente de pico del proceso.
+    """
+    configs = configs or XTTS_BENCHMARK_CONFIGS
+    sentences = sentences or BENCHMARK_SENTENCES
+    context = multiprocessing.get_context("spawn")
+    report = {}
+    for name, config in configs.items():
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            report[name] = executor.submit(_benchmark_xtts_config, config, sentences, voice_id, language).result()
+    return report
+
+
+def benchmark_elevenlabs(
+    base_url: str,
+    texts: List[str] = None,
+    voice_id: str = "benchmark",
+    api_key: str = "benchmark",
+    concurrency_levels=(1, 2, 4, 8),
+) -> Dict[int, dict]:
+    """
+    Mide el rendimiento de `synthesize_many` de ElevenLabs contra una API
+    compatible en `base_url` (por ejemplo, un servidor falso local que imite
+    `POST /v1/text-to-speech/{voice_id}`), sin caché de audio. Devuelve, por
+    nivel de concurrencia, el tiempo total, textos por segundo, bytes
+    recibidos y audios vacíos (fallidos).
+    """
+    texts = texts or BENCHMARK_SENTENCES * 4
+    report = {}
+    for workers in concurrency_levels:
+        engine = ElevenLabsTTS(api_key, base_url=base_url, max_workers=workers)
+        start = time.perf_counter()
+        audios = engine.synthesize_many(voice_id, texts, use_cache=False)
+        elapsed = time.perf_counter() - start
+        report[workers] = {
+            "seconds": elapsed,
+            "texts_per_second": len(texts) / elapsed if elapsed else None,
+            "bytes": sum(len(audio) for audio in audios),
+            "failed": sum(1 for audio in audios if not audio),
+        }
+    return report
+
+
 # Función fábrica para instanciar el proveedor deseado
 def get_tts_provider(provider: str, api_key: str = None, voice_id: str = 'a', reference_voice: str = None) -> TTSEngine:
     if provider.lower() == "elevenlabs":
@@ -205,3 +649,17 @@ def get_tts_provider(provider: str, api_key: str = None, voice_id: str = 'a', re
         return OuterTTSTTS()
     else:
         raise ValueError(f"Proveedor TTS no soportado: {provider}")
+
+
+if __name__ == "__main__":
+    # python -m utils.TTSUtils                          → XTTSv2 en CPU
+    # python -m utils.TTSUtils --elevenlabs <base_url>  → ElevenLabs contra una API compatible
+    if len(sys.argv) == 3 and sys.argv[1] == "--elevenlabs":
+        for workers, result in benchmark_elevenlabs(sys.argv[2]).items():
+            print(f"{workers} simultáneas: {result['seconds']:.2f}s, {result['texts_per_second']:.1f} textos/s, "
+                  f"{result['bytes']} bytes, {result['failed']} fallidos")
+        sys.exit(0)
+    for name, result in benchmark_xtts().items():
+        peak = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "n/d"
+        print(f"{name}: RTF {result['rtf']:.2f} ({result['seconds']:.1f}s para {result['audio_seconds']:.1f}s de audio), "
+              f"pico RSS {peak}, {result['threads']} hilos, int8={result['quantized']}")
@@ -0,0 +1,81 @@
+import re
+import unicodedata
+from typing import List, Tuple
+
+"""
+Módulo: TextUtils.py
+
+Utilidades de texto compartidas: normalización para claves de caché y
+división en frases conservando los separadores originales, de modo que un
+texto procesado por frases (traducción, síntesis de voz) pueda recomponerse
+con su misma estructura de párrafos, y agrupación de frases en fragmentos de
+longitud acotada para modelos con un límite de caracteres por entrada.
+"""
+
+# Corte tras signos de fin de frase seguidos de espacio, o en saltos de línea
+_SENTENCE_BOUNDARY = re.compile(r"((?<=[.!?…。！？])\s+|\s*\n\s*)")
+# Corte tras signos de pausa dentro de una frase
+_CLAUSE_BOUNDARY = re.compile(r"(?<=[,;:，；：])\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Forma canónica de un texto: Unicode NFC, espacios colapsados y sin espacios en los extremos."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def split_sentences(text: str) -> List[Tuple[str, str]]:
+    """
+    Divide un texto en frases. Devuelve pares (frase, separador) tales que
+    `"".join(frase + separador)` reproduce el texto original; los separadores
+    conservan los saltos de línea (párrafos) y los espacios entre frases.
+    """
+    parts = _SENTENCE_BOUNDARY.split(text)
+    # re.split con grupo de captura alterna [frase, separador, frase, ...]
+    sentences = parts[0::2]
+    separators = parts[1::2] + [""]
+    return [(sentence, separator) for sentence, separator in zip(sentences, separators) if sentence or separator]
+
+
+def _pack(parts: List[str], max_chars: int) -> List[str]:
+    """Une partes consecutivas con espacios mientras quepan en `max_chars`."""
+    chunks, current = [], ""
+    for part in parts:
+        if current and len(current) + 1 + len(part) > max_chars:
+            chunks.append(current)
+            current = part
+        else:
+            current = f"{current} {part}" if current else part
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _split_long(text: str, max_chars: int) -> List[str]:
+    """Parte un texto más largo que `max_chars` por pausas, luego por palabras y, en último caso, por caracteres."""
+    if len(text) <= max_chars:
+        return [text]
+    clauses = _CLAUSE_BOUNDARY.split(text)
+    if len(clauses) > 1:
+        parts = [part for clause in clauses for part in _split_long(clause, max_chars)]
+    else:
+        words = text.split()
+        if len(words) > 1:
+            parts = [part for word in words for part in _split_long(word, max_chars)]
+        else:
+            parts = [text[start:start + max_chars] for start in range(0, len(text), max_chars)]
+    return _pack(parts, max_chars)
+
+
+def chunk_sentences(text: str, max_chars: int) -> List[str]:
+    """
+    Agrupa las frases de un texto en fragmentos de como mucho `max_chars`
+    caracteres sin partir frases; una frase que no cabe se parte por sus
+    pausas (comas, punto y coma, dos puntos) o, si no basta, por palabras.
+    """
+    parts = [
+        part
+        for sentence, _ in split_sentences(text)
+        if sentence.strip()
+        for part in _split_long(sentence.strip(), max_chars)
+    ]
+    return _pack(parts, max_chars)
@@ -1,6 +1,13 @@
 from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
 import torch
 import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List
+from utils.CacheUtils import get_cache_dir, hash_content
+from utils.TextUtils import normalize_text, split_sentences
 
 torch.classes.__path__ = [os.path.join(torch.__path__[0], torch.classes.__file__)]
 
@@ -11,12 +18,140 @@ Este módulo define la clase Translator que encapsula la lógica de traducción
 utilizando Open-NLLB de Hugging Face y aplica el patrón singleton.
 """
 
+# Número de frases que se traducen juntas en cada pasada del modelo
+DEFAULT_BATCH_SIZE = 8
+# Ventana del codificador: los segmentos más largos se parten (tokens, sin contar los especiales)
+MAX_SOURCE_TOKENS = 200
+# Presupuesto de decodificación por lote: tokens de salida = ratio * tokens de entrada + margen
+DECODE_LENGTH_RATIO = 1.5
+DECODE_LENGTH_MARGIN = 10
+# Máximo de frases guardadas en la memoria de traducción (se expulsan las menos usadas)
+TRANSLATION_MEMORY_MAX_ENTRIES = int(os.environ.get("SLIDES2VIDEO_TM_MAX_ENTRIES", "200000"))
+
+class TranslationMemory:
+    """
+    Memoria de traducción persistente en SQLite a nivel de frase.
+
+    La clave es (modelo, idioma origen, idioma destino, hash del texto
+    normalizado), así que una nota editada solo paga por sus frases nuevas.
+    Lleva la cuenta de aciertos/fallos y expulsa las entradas usadas hace más
+    tiempo cuando se supera `max_entries`.
+    """
+
+    def __init__(self, path: str = None, max_entries: int = TRANSLATION_MEMORY_MAX_ENTRIES) -> None:
+        self.path = path or os.path.join(get_cache_dir("translation"), "memory.sqlite3")
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS memory ("
+                "key TEXT PRIMARY KEY, model TEXT, src TEXT, tgt TEXT, translation TEXT, last_used REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS memory_last_used ON memory (last_used)")
+
+    @staticmethod
+    def key(model_name: str, source_lang: str, target_lang: str, text: str) -> str:
+        return hash_content(model_name, source_lang, target_lang, normalize_text(text))
+
+    def lookup(self, model_name: str, source_lang: str, target_lang: str, texts: List[str]) -> Dict[str, str]:
+        """Devuelve {texto: traducción} para los textos que ya están en la memoria."""
+        keys = {self.key(model_name, source_lang, target_lang, text): text for text in texts}
+        found = {}
+        with self._lock:
+            for key, text in keys.items():
+                row = self._conn.execute("SELECT translation FROM memory WHERE key = ?", (key,)).fetchone()
+                if row:
+                    found[text] = row[0]
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE memory SET last_used = ? WHERE key = ?",
+                    [(time.time(), self.key(model_name, source_lang, target_lang, text)) for text in found]
+                )
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def store(self, model_name: str, source_lang: str, target_lang: str, translations: Dict[str, str]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO memory VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (self.key(model_name, source_lang, target_lang, text), model_name, source_lang, target_lang, translation, now)
+                    for text, translation in translations.items()
+                ]
+            )
+            excess = self._conn.execute("SELECT COUNT(*) FROM memory").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM memory WHERE key IN (SELECT key FROM memory ORDER BY last_used LIMIT ?)", (excess,)
+                )
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+# Motores de inferencia disponibles: PyTorch en precisión completa o una
+# exportación int8 del mismo modelo ejecutada con CTranslate2 (optimizada para CPU)
+TRANSLATION_BACKENDS = ("torch", "ctranslate2")
+
 class Translator:
-    def __init__(self, model_name: str = "facebook/nllb-200-distilled-600M", token: bool = False) -> None:
+    _instances = {}
+
+    def __new__(cls, model_name: str = "facebook/nllb-200-distilled-600M", token: bool = False, backend: str = "torch"):
+        # Una única instancia residente por modelo y motor, compartida entre llamadas y sesiones
+        if (model_name, backend) not in cls._instances:
+            cls._instances[(model_name, backend)] = super(Translator, cls).__new__(cls)
+        return cls._instances[(model_name, backend)]
+
+    def __init__(self, model_name: str = "facebook/nllb-200-distilled-600M", token: bool = False, backend: str = "torch") -> None:
         if not hasattr(self, "model"):
-            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            if backend not in TRANSLATION_BACKENDS:
+                raise ValueError(f"Motor de traducción no soportado: {backend}")
             self.model_name = model_name
-            self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name, token=token).to(self.device)
+            self.backend = backend
+            if backend == "ctranslate2":
+                self.device = torch.device("cpu")
+                self.model = self._load_ctranslate2(model_name)
+                # Las traducciones cuantizadas no se mezclan con las de precisión completa en la memoria
+                self.memory_model_id = f"{model_name}:ctranslate2-int8"
+            else:
+                self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+                self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name, token=token).to(self.device)
+                self.model.eval()
+                self.memory_model_id = model_name
+            self.tokenizer = AutoTokenizer.from_pretrained(
+                model_name,
+                token=token,
+                use_fast=False  # Forzamos el uso del tokenizador lento
+            )
+            # El idioma origen es estado del tokenizador: las traducciones se serializan
+            self._lock = threading.Lock()
+            self.memory = TranslationMemory()
+
+    @staticmethod
+    def _load_ctranslate2(model_name: str):
+        """
+        Carga la exportación int8 del modelo para CTranslate2. La conversión
+        desde Hugging Face se hace una sola vez y se guarda en la caché.
+        """
+        import ctranslate2
+
+        output_dir = os.path.join(get_cache_dir("ctranslate2"), model_name.replace("/", "--") + "-int8")
+        if not os.path.exists(os.path.join(output_dir, "model.bin")):
+            converter = ctranslate2.converters.TransformersConverter(model_name)
+            converter.convert(output_dir, quantization="int8", force=True)
+        return ctranslate2.Translator(output_dir, device="cpu", compute_type="int8")
 
     def translate_notes(self, source_lang: str, target_lang: str, text: str) -> str:
         """
@@ -33,15 +168,205 @@ class Translator:
         Retorna:
             str: Texto traducido.
         """
-        tokenizer = AutoTokenizer.from_pretrained(
-            self.model_name,
-            token=False,
-            src_lang=source_lang,
-            tgt_lang=target_lang,
-            use_fast=False  # Forzamos el uso del tokenizador lento
+        return self.translate_batch(source_lang, target_lang, [text])[0]
+
+    def translate_batch(
+        self,
+        source_lang: str,
+        target_lang: str,
+        texts: List[str],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        progress_callback: Callable[[int, int], None] = None,
+        use_memory: bool = True,
+    ) -> List[str]:
+        """
+        Traduce todas las notas de una presentación en una sola pasada.
+
+        Cada nota se divide en frases; las frases ya presentes en la memoria de
+        traducción se reutilizan y el resto se parte, si hace falta, en
+        segmentos que caben en la ventana del codificador (ver
+        `_fit_to_window`) y se traduce por lotes (ver `_translate_segments`).
+        Cada nota se recompone con sus separadores y párrafos originales. Las
+        notas vacías se devuelven vacías y el resultado conserva el orden de
+        `texts`.
+
+        Parámetros:
+            progress_callback: función opcional (traducidas, total) llamada tras cada lote.
+            use_memory: consultar y alimentar la memoria de traducción.
+        """
+        notes_sentences = [split_sentences(text) for text in texts]
+        unique = list(dict.fromkeys(
+            sentence.strip() for sentences in notes_sentences for sentence, _ in sentences if sentence.strip()
+        ))
+        translations = self.memory.lookup(self.memory_model_id, source_lang, target_lang, unique) if use_memory else {}
+        missing = [sentence for sentence in unique if sentence not in translations]
+        if missing:
+            sentence_segments = {sentence: self._fit_to_window(sentence) for sentence in missing}
+            segments = list(dict.fromkeys(segment for chunks in sentence_segments.values() for segment in chunks))
+            segment_translations = dict(zip(segments, self._translate_segments(source_lang, target_lang, segments, batch_size, progress_callback)))
+            new_translations = {
+                sentence: " ".join(segment_translations[segment] for segment in chunks)
+                for sentence, chunks in sentence_segments.items()
+            }
+            translations.update(new_translations)
+            if use_memory:
+                self.memory.store(self.memory_model_id, source_lang, target_lang, new_translations)
+        elif progress_callback and unique:
+            # Todo salió de la memoria; sin frases (notas vacías) no hay progreso que notificar
+            progress_callback(len(unique), len(unique))
+
+        results = []
+        for sentences in notes_sentences:
+            parts = []
+            for sentence, separator in sentences:
+                stripped = sentence.strip()
+                if stripped:
+                    leading = sentence[:len(sentence) - len(sentence.lstrip())]
+                    trailing = sentence[len(sentence.rstrip()):]
+                    sentence = leading + translations[stripped] + trailing
+                parts.append(sentence + separator)
+            results.append("".join(parts))
+        return results
+
+    def _count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def _fit_to_window(self, text: str, max_tokens: int = MAX_SOURCE_TOKENS) -> List[str]:
+        """
+        Parte un texto que no cabe en la ventana del codificador en segmentos
+        de como mucho `max_tokens` tokens, cortando primero por cláusulas
+        (comas, punto y coma, dos puntos) y, si no basta, por palabras.
+        """
+        if self._count_tokens(text) <= max_tokens:
+            return [text]
+        pieces = re.split(r"(?<=[,;:])\s+", text)
+        if len(pieces) == 1:
+            pieces = text.split()
+        if len(pieces) == 1:
+            return [text]
+
+        segments, current, current_tokens = [], "", 0
+        for piece in pieces:
+            piece_tokens = self._count_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                segments.append(current)
+                current, current_tokens = piece, piece_tokens
+            else:
+                current = f"{current} {piece}" if current else piece
+                current_tokens += piece_tokens
+        segments.append(current)
+        # Una cláusula que por sí sola no cabe se vuelve a partir por palabras
+        return [chunk for segment in segments for chunk in (
+            self._fit_to_window(segment, max_tokens) if segment != text else [segment]
+        )]
+
+    def _translate_segments(
+        self,
+        source_lang: str,
+        target_lang: str,
+        segments: List[str],
+        batch_size: int,
+        progress_callback: Callable[[int, int], None] = None,
+    ) -> List[str]:
+        """
+        Traduce una lista de segmentos con el modelo. Se ordenan por número de
+        tokens y se agrupan en lotes de `batch_size` con relleno (padding), de
+        modo que cada lote es una única llamada a `generate` con secuencias de
+        tamaño parecido. El límite de decodificación de cada lote se deriva de
+        los tokens de su segmento más largo. El resultado conserva el orden de
+        `segments`.
+        """
+        results = ["" for _ in segments]
+        total = len(segments)
+        with self._lock:
+            self.tokenizer.src_lang = source_lang
+            token_counts = [self._count_tokens(segment) for segment in segments]
+            pending = sorted(range(total), key=lambda idx: token_counts[idx])
+            for start in range(0, total, batch_size):
+                batch = pending[start:start + batch_size]
+                batch_texts = [segments[idx] for idx in batch]
+                max_new_tokens = int(max(token_counts[idx] for idx in batch) * DECODE_LENGTH_RATIO) + DECODE_LENGTH_MARGIN
+                if self.backend == "ctranslate2":
+                    translations = self._generate_ctranslate2(batch_texts, target_lang, max_new_tokens)
+                else:
+                    translations = self._generate_torch(batch_texts, target_lang, max_new_tokens)
+                for idx, translation in zip(batch, translations):
+                    results[idx] = translation
+                if progress_callback:
+                    progress_callback(min(start + batch_size, total), total)
+        return results
+
+    def _generate_torch(self, texts: List[str], target_lang: str, max_new_tokens: int) -> List[str]:
+        """Traduce un lote con el modelo de PyTorch."""
+        inputs = self.tokenizer(texts, return_tensors="pt", padding=True).to(self.device)
+        forced_bos_token_id = self.tokenizer.convert_tokens_to_ids(target_lang)
+        with torch.inference_mode():
+            translated_tokens = self.model.generate(**inputs, forced_bos_token_id=forced_bos_token_id, max_new_tokens=max_new_tokens)
+        return self.tokenizer.batch_decode(translated_tokens, skip_special_tokens=True)
+
+    def _generate_ctranslate2(self, texts: List[str], target_lang: str, max_new_tokens: int) -> List[str]:
+        """Traduce un lote con la exportación int8 de CTranslate2."""
+        source_tokens = [self.tokenizer.convert_ids_to_tokens(self.tokenizer.encode(text)) for text in texts]
+        outputs = self.model.translate_batch(
+            source_tokens,
+            target_prefix=[[target_lang]] * len(texts),
+            max_batch_size=len(texts),
+            max_decoding_length=max_new_tokens + 1,  # + el prefijo de idioma
         )
-        inputs = tokenizer(text, return_tensors="pt").to(self.device)
-        max_length = len(text) * 2
-        translated_tokens = self.model.generate(**inputs, forced_bos_token_id=tokenizer.convert_tokens_to_ids(target_lang), max_length=max_length)
-        translation = tokenizer.batch_decode(translated_tokens, skip_special_tokens=True)[0]
-        return translation
+        # El primer token de cada hipótesis es el prefijo con el idioma destino
+        return [
+            self.tokenizer.decode(self.tokenizer.convert_tokens_to_ids(output.hypotheses[0][1:]), skip_special_tokens=True)
+            for output in outputs
+        ]
+
+
+# Notas fijas para comparar los motores de traducción
+BENCHMARK_NOTES = [
+    "Bienvenidos a la clase de hoy.",
+    "En esta diapositiva vemos la arquitectura general del sistema y cómo se comunican sus componentes.",
+    "El algoritmo recorre la lista una sola vez, por lo que su coste es lineal en el número de elementos.",
+    "Fijaos en la gráfica: a partir de mil usuarios el tiempo de respuesta crece de forma exponencial.\n"
+    "Por eso introducimos una caché delante de la base de datos.",
+    "Como resumen, hemos visto tres ideas clave: modularidad, pruebas automáticas y despliegue continuo.",
+    "¿Alguna pregunta antes de pasar al siguiente tema?",
+]
+
+def benchmark_backends(
+    source_lang: str = "spa_Latn",
+    target_lang: str = "eng_Latn",
+    notes: List[str] = None,
+    backends=TRANSLATION_BACKENDS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Dict[str, dict]:
+    """
+    Compara latencia y salida de los motores de traducción sobre un conjunto
+    fijo de notas (sin memoria de traducción). Para cada motor devuelve el
+    tiempo de la pasada completa (tras un calentamiento), las traducciones y,
+    respecto al primer motor, la proporción de salidas idénticas y la
+    similitud media de caracteres.
+    """
+    from difflib import SequenceMatcher
+
+    notes = notes or BENCHMARK_NOTES
+    report = {}
+    reference = None
+    for backend in backends:
+        translator = Translator(backend=backend)
+        translator.translate_batch(source_lang, target_lang, notes[:1], batch_size, use_memory=False)
+        start = time.perf_counter()
+        outputs = translator.translate_batch(source_lang, target_lang, notes, batch_size, use_memory=False)
+        elapsed = time.perf_counter() - start
+        reference = reference or outputs
+        report[backend] = {
+            "seconds": elapsed,
+            "outputs": outputs,
+            "exact_match": sum(a == b for a, b in zip(outputs, reference)) / len(notes),
+            "similarity": sum(SequenceMatcher(None, a, b).ratio() for a, b in zip(outputs, reference)) / len(notes),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    # python -m utils.TranlationUtils
+    for backend, result in benchmark_backends().items():
+        print(f"{backend}: {result['seconds']:.2f}s, idénticas {result['exact_match']:.0%}, similitud {result['similarity']:.2f}")
@@ -1,25 +1,254 @@
 import base64
-from typing import List, Dict, Any
+import copy
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import List, Dict, Any, Callable, Iterator
 import logging
 from abc import ABC, abstractmethod
 from google import genai
 from PIL import Image
 from google.genai import types
+from utils.CacheUtils import DiskCache, hash_content
+from utils.SlideUtils import RawSlide, cached_payload, encode_payload, image_mime_type, slide_to_bytes, source_size
+
+
+SYSTEM_INSTRUCTION = "You are an AI assistant that generates narrative descriptions for presentation slides. Only answer with the explanation of the slide, nothing else."
+BATCH_SYSTEM_INSTRUCTION = "You are an AI assistant that generates narrative descriptions for the slides of a presentation. Only answer with the requested JSON object, nothing else."
+
+# Longitud máxima del resumen de las diapositivas anteriores que se arrastra entre lotes
+BATCH_SUMMARY_MAX_CHARS = 600
+# Tokens de salida que se reservan en cada lote para el resumen
+BATCH_SUMMARY_TOKENS = 200
+
+# Nivel solo texto: cobertura de texto por defecto a partir de la cual una
+# diapositiva se describe a partir de su texto, y longitud mínima de ese texto
+TEXT_COVERAGE_THRESHOLD = 0.8
+TEXT_ONLY_MIN_CHARS = 40
+
+# Códigos HTTP que merece la pena reintentar (límite de peticiones y errores transitorios)
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Caché en disco de respuestas del VLM (tamaño máximo en MB)
+VLM_CACHE_MAX_BYTES = int(os.environ.get("SLIDES2VIDEO_VLM_CACHE_MB", "64")) * 1024 * 1024
+_vlm_cache = None
+
+# Presupuesto de bytes por imagen enviada al VLM (en KB)
+VLM_PAYLOAD_MAX_BYTES = int(os.environ.get("SLIDES2VIDEO_VLM_PAYLOAD_KB", "400")) * 1024
+
+
+def get_vlm_cache() -> DiskCache:
+    """Caché de respuestas compartida por todos los VLM del proceso."""
+    global _vlm_cache
+    if _vlm_cache is None:
+        _vlm_cache = DiskCache("vlm", max_bytes=VLM_CACHE_MAX_BYTES, suffix=".txt")
+    return _vlm_cache
+
+
+class TokenBucket:
+    """
+    Limitador de peticiones por minuto (RPM) y tokens por minuto (TPM).
+
+    Cada límite es un cubo que se rellena de forma continua hasta su
+    capacidad por minuto; `acquire` bloquea hasta que hay una petición y los
+    tokens estimados disponibles. Un límite a None no se aplica.
+    """
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens: int = 0) -> None:
+        while True:
+            with self._lock:
+                self._refill()
+                # Una petición mayor que el cubo entero solo espera a tenerlo lleno
+                tokens_needed = min(tokens, self.tokens_per_minute) if self.tokens_per_minute else 0
+                wait = 0.0
+                if self.requests_per_minute and self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+                if self.tokens_per_minute and self._tokens < tokens_needed:
+                    wait = max(wait, (tokens_needed - self._tokens) * 60 / self.tokens_per_minute)
+                if wait == 0.0:
+                    if self.requests_per_minute:
+                        self._requests -= 1
+                    if self.tokens_per_minute:
+                        self._tokens -= tokens_needed
+                    return
+            time.sleep(wait)
+
+
+def _parse_batch_response(text: str, numbers: List[int]):
+    """
+    Extrae de la respuesta JSON de un lote las narraciones por número de
+    diapositiva y el resumen. Lanza ValueError si la respuesta no es válida.
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise ValueError("The response does not contain a JSON object")
+    data = json.loads(text[start:end + 1])
+    if not isinstance(data, dict) or not isinstance(data.get("narrations"), list):
+        raise ValueError("The response has no 'narrations' list")
+
+    items = []
+    for item in data["narrations"]:
+        if not isinstance(item, dict) or not isinstance(item.get("narration"), str):
+            continue
+        try:
+            number = int(item.get("slide"))
+        except (TypeError, ValueError):
+            number = None
+        items.append((number, item["narration"].strip()))
+    if all(number in numbers for number, _ in items):
+        narrations = {number: narration for number, narration in items if narration}
+    elif len(items) == len(numbers):
+        # El modelo numeró las diapositivas del lote desde 1: se asignan por orden
+        narrations = {number: narration for number, (_, narration) in zip(numbers, items) if narration}
+    else:
+        raise ValueError("The slide numbers in the response do not match the batch")
+    summary = data.get("summary")
+    return narrations, summary.strip()[:BATCH_SUMMARY_MAX_CHARS] if isinstance(summary, str) else ""
+
+
+def _is_retryable(exc: Exception) -> bool:
+    """Indica si un error de la API es transitorio (límite de peticiones, timeout, 5xx...)."""
+    status = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS_CODES
+    name = type(exc).__name__
+    return any(marker in name for marker in ("RateLimit", "Timeout", "Connection"))
 
 
 class BaseVLM(ABC):
-    def __init__(self, base_url: str, model_identifier: str, api_key: str = None):
+    # Estimación de tokens de entrada que consume una imagen (para el límite TPM)
+    image_token_estimate = 1000
+    # Temperatura de generación (None = la del servidor); forma parte de la clave de caché
+    temperature = None
+    # Resolución efectiva de visión del modelo (lado mayor, en píxeles) y formato de envío
+    vision_max_side = 1280
+    payload_format = "JPEG"
+
+    def __init__(
+        self,
+        base_url: str,
+        model_identifier: str,
+        api_key: str = None,
+        use_cache: bool = True,
+        optimize_images: bool = True,
+    ):
         self.base_url = base_url
         self.model_identifier = model_identifier
         self.api_key = api_key
         self.logger = logging.getLogger(__name__)
         self.client = None
+        self.max_retries = 5
+        self.backoff_base = 1.0
+        self.use_cache = use_cache
+        self.optimize_images = optimize_images
+        self.payload_max_bytes = VLM_PAYLOAD_MAX_BYTES
+        self._stats_lock = threading.Lock()
+        self.tier_stats = {"text_slides": 0, "image_slides": 0, "text_seconds": 0.0, "image_seconds": 0.0, "saved_bytes": 0}
+        self.payload_stats = {
+            "images": 0,
+            "source_bytes": 0,
+            "payload_bytes": 0,
+            "encode_seconds": 0.0,
+            "requests": 0,
+            "request_seconds": 0.0,
+        }
 
     @abstractmethod
+    def _generate_images(
+        self,
+        images: List[Any],
+        prompt_user: str,
+        max_tokens: int,
+        system_instruction: str = SYSTEM_INSTRUCTION,
+        json_output: bool = False,
+    ) -> str:
+        """Envía una petición con las imágenes dadas; lanza la excepción del proveedor si falla."""
+        pass
+
+    def _generate(self, image_obj: Any, prompt_user: str, max_tokens: int) -> str:
+        """Genera la narración de una diapositiva; lanza la excepción del proveedor si falla."""
+        return self._generate_images([image_obj], prompt_user, max_tokens)
+
+    def _stream_images(
+        self,
+        images: List[Any],
+        prompt_user: str,
+        max_tokens: int,
+        system_instruction: str = SYSTEM_INSTRUCTION,
+    ) -> Iterator[str]:
+        """Variante en streaming de `_generate_images`; por defecto entrega la respuesta completa de una vez."""
+        yield self._generate_images(images, prompt_user, max_tokens, system_instruction)
+
     def process_single_slide(
         self, image_obj: Any, prompt_user: str, max_tokens: int = 1000
     ) -> str:
-        pass
+        try:
+            return self._generate_with_retry(image_obj, prompt_user, max_tokens)
+        except Exception as e:
+            self.logger.error(f"Error processing slide with {self.model_identifier}: {str(e)}")
+            return ""
+
+    def stream_single_slide(
+        self, image_obj: Any, prompt_user: str, max_tokens: int = 1000
+    ) -> Iterator[str]:
+        """
+        Genera la narración de una diapositiva entregando los fragmentos de
+        texto según llegan. Una respuesta en caché se entrega de una vez. Los
+        errores transitorios se reintentan solo antes del primer fragmento;
+        después, como en `process_single_slide`, el error se registra y la
+        narración queda con lo recibido.
+        """
+        cache_key = None
+        if self.use_cache:
+            cache_key = self._cache_key([image_obj], prompt_user, max_tokens)
+            cached = get_vlm_cache().get(cache_key)
+            if cached is not None:
+                yield cached.decode("utf-8")
+                return
+
+        chunks = []
+        for attempt in range(self.max_retries + 1):
+            try:
+                start = time.perf_counter()
+                for chunk in self._stream_images([image_obj], prompt_user, max_tokens):
+                    if chunk:
+                        chunks.append(chunk)
+                        yield chunk
+                with self._stats_lock:
+                    self.payload_stats["requests"] += 1
+                    self.payload_stats["request_seconds"] += time.perf_counter() - start
+                break
+            except Exception as e:
+                if chunks or attempt == self.max_retries or not _is_retryable(e):
+                    self.logger.error(f"Error processing slide with {self.model_identifier}: {str(e)}")
+                    return
+                delay = self.backoff_base * 2 ** attempt + random.uniform(0, self.backoff_base)
+                self.logger.warning(f"Retrying slide in {delay:.1f}s after error: {str(e)}")
+                time.sleep(delay)
+
+        if cache_key and chunks:
+            get_vlm_cache().put(cache_key, "".join(chunks).encode("utf-8"))
 
     @abstractmethod
     def get_narrative_from_slides(
@@ -31,55 +260,495 @@ class BaseVLM(ABC):
     ) -> List[str]:
         pass
 
+    def _prepare_image(self, image_obj: Any):
+        """
+        Bytes y tipo MIME de la imagen que se envía al modelo. Con
+        `optimize_images` se ajusta a `vision_max_side` y al presupuesto de
+        bytes; si no, se envía la imagen original (PNG para RawSlide).
+        """
+        start = time.perf_counter()
+        if self.optimize_images:
+            payload, mime_type = encode_payload(
+                image_obj, self.vision_max_side, self.payload_max_bytes, self.payload_format
+            )
+        else:
+            payload = slide_to_bytes(image_obj)
+            mime_type = image_mime_type(payload)
+        elapsed = time.perf_counter() - start
+        # Tamaño de referencia: sin optimizar es lo enviado; optimizando, el original sin codificarlo
+        # (muestras crudas de una RawSlide), para no generar ni retener un PNG solo para el informe
+        source_bytes = len(payload) if not self.optimize_images else source_size(image_obj)
+        with self._stats_lock:
+            self.payload_stats["images"] += 1
+            self.payload_stats["source_bytes"] += source_bytes
+            self.payload_stats["payload_bytes"] += len(payload)
+            self.payload_stats["encode_seconds"] += elapsed
+        return payload, mime_type
+
+    def payload_report(self) -> Dict[str, Any]:
+        """
+        Resumen de bytes enviados frente a los de origen (la imagen sin
+        comprimir si se optimiza) y latencia media por petición.
+        """
+        with self._stats_lock:
+            stats = dict(self.payload_stats)
+        stats["saved_bytes"] = stats["source_bytes"] - stats["payload_bytes"]
+        stats["saved_ratio"] = stats["saved_bytes"] / stats["source_bytes"] if stats["source_bytes"] else 0.0
+        stats["avg_request_seconds"] = stats["request_seconds"] / stats["requests"] if stats["requests"] else 0.0
+        return stats
+
+    def compare_payload_latency(
+        self, image_obj: Any, prompt_user: str, max_tokens: int = 1000
+    ) -> Dict[str, Any]:
+        """
+        Envía la misma diapositiva dos veces, sin caché, con la imagen original y
+        con la optimizada, y devuelve bytes y segundos de cada petición. Cuesta
+        dos peticiones al modelo, así que se usa como medida puntual.
+        """
+        results = {}
+        for name, optimize in (("original", False), ("optimized", True)):
+            # Copia con sus propias estadísticas que comparte el cliente del proveedor
+            probe = copy.copy(self)
+            probe.use_cache = False
+            probe.optimize_images = optimize
+            probe._stats_lock = threading.Lock()
+            probe.payload_stats = dict.fromkeys(self.payload_stats, 0)
+            probe._request_with_retry([image_obj], prompt_user, max_tokens)
+            results[f"{name}_bytes"] = probe.payload_stats["payload_bytes"]
+            results[f"{name}_seconds"] = probe.payload_stats["request_seconds"]
+        original = results["original_seconds"]
+        results["saved_seconds"] = original - results["optimized_seconds"]
+        results["saved_ratio"] = results["saved_seconds"] / original if original else 0.0
+        return results
+
+    def _estimate_tokens(self, prompt_user: str, max_tokens: int, num_images: int = 1) -> int:
+        return len(prompt_user) // 4 + self.image_token_estimate * num_images + max_tokens
+
+    def _endpoint_identity(self) -> Any:
+        """Servidor que atiende las peticiones, como parte de la clave de caché."""
+        return self.base_url
+
+    def _cache_key(
+        self, images: List[Any], prompt_user: str, max_tokens: int, system_instruction: str = SYSTEM_INSTRUCTION
+    ) -> str:
+        """
+        Clave de la respuesta: hash exacto de las imágenes (muestras crudas si
+        son RawSlide), prompt, instrucción de sistema, proveedor, servidor,
+        modelo y parámetros de generación.
+        """
+        image_contents = [
+            image_obj.array if isinstance(image_obj, RawSlide) else slide_to_bytes(image_obj)
+            for image_obj in images
+        ]
+        # El preprocesado cambia lo que ve el modelo, así que también forma parte de la clave
+        preprocessing = None
+        if self.optimize_images:
+            preprocessing = [self.vision_max_side, self.payload_format, self.payload_max_bytes]
+        return hash_content(
+            *image_contents,
+            prompt_user,
+            system_instruction,
+            type(self).__name__,
+            self._endpoint_identity(),
+            self.model_identifier,
+            {"max_tokens": max_tokens, "temperature": self.temperature, "preprocessing": preprocessing},
+        )
+
+    def _generate_with_retry(
+        self, image_obj: Any, prompt_user: str, max_tokens: int, rate_limiter: TokenBucket = None
+    ) -> str:
+        """Narración de una diapositiva con caché, limitador y reintentos."""
+        return self._request_with_retry([image_obj], prompt_user, max_tokens, rate_limiter)
+
+    def _request_with_retry(
+        self,
+        images: List[Any],
+        prompt_user: str,
+        max_tokens: int,
+        rate_limiter: TokenBucket = None,
+        system_instruction: str = SYSTEM_INSTRUCTION,
+        json_output: bool = False,
+        parse: Callable[[str], Any] = None,
+    ) -> Any:
+        """
+        Llama a `_generate_images` respetando el limitador y reintentando con
+        backoff exponencial. Con `use_cache` las respuestas se sirven y guardan
+        en la caché en disco (un acierto no consume cuota del limitador). Si se
+        da `parse`, se devuelve su resultado y solo se guardan en caché las
+        respuestas que interpreta sin error.
+        """
+        cache_key = None
+        if self.use_cache:
+            cache_key = self._cache_key(images, prompt_user, max_tokens, system_instruction)
+            cached = get_vlm_cache().get(cache_key)
+            if cached is not None:
+                text = cached.decode("utf-8")
+                return parse(text) if parse else text
+
+        for attempt in range(self.max_retries + 1):
+            if rate_limiter:
+                rate_limiter.acquire(self._estimate_tokens(prompt_user, max_tokens, len(images)))
+            try:
+                start = time.perf_counter()
+                text = self._generate_images(images, prompt_user, max_tokens, system_instruction, json_output)
+                with self._stats_lock:
+                    self.payload_stats["requests"] += 1
+                    self.payload_stats["request_seconds"] += time.perf_counter() - start
+                result = parse(text) if parse else text
+                if cache_key and text:
+                    get_vlm_cache().put(cache_key, text.encode("utf-8"))
+                return result
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e):
+                    raise
+                delay = self.backoff_base * 2 ** attempt + random.uniform(0, self.backoff_base)
+                self.logger.warning(f"Retrying slide in {delay:.1f}s after error: {str(e)}")
+                time.sleep(delay)
+
+    def _run_concurrently(
+        self,
+        tasks: List[Callable[[], str]],
+        max_workers: int,
+        progress_callback: Callable[[int, int, int], None] = None,
+    ) -> List[str]:
+        """
+        Ejecuta las peticiones dadas con como mucho `max_workers` simultáneas.
+        Los resultados se devuelven en el orden de las tareas ("" si una falla)
+        y `progress_callback` (completadas, total, índice) se invoca desde el
+        hilo que llama.
+        """
+        narratives = [""] * len(tasks)
+        if not tasks:
+            return narratives
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {executor.submit(task): idx for idx, task in enumerate(tasks)}
+            for done, future in enumerate(as_completed(futures), 1):
+                idx = futures[future]
+                try:
+                    narratives[idx] = future.result()
+                except Exception as e:
+                    self.logger.error(f"Error processing slide {idx}: {str(e)}")
+                if progress_callback:
+                    progress_callback(done, len(tasks), idx)
+        return narratives
+
+    def _generate_concurrently(
+        self,
+        images: List[Any],
+        prompt_user: str,
+        max_tokens: int,
+        max_workers: int,
+        rate_limiter: TokenBucket = None,
+        progress_callback: Callable[[int, int, int], None] = None,
+    ) -> List[str]:
+        """Genera las narraciones de las diapositivas dadas con una petición con imagen por diapositiva."""
+        tasks = [
+            partial(self._generate_with_retry, image_obj, prompt_user, max_tokens, rate_limiter)
+            for image_obj in images
+        ]
+        return self._run_concurrently(tasks, max_workers, progress_callback)
+
+    def _text_prompt(self, prompt_user: str, content: str) -> str:
+        return (
+            "The slide is mostly text and is not attached. This is its text content:\n\n"
+            f"{content}\n\n{prompt_user}"
+        )
+
+    def _generate_from_text(
+        self,
+        contents: List[str],
+        prompt_user: str,
+        max_tokens: int,
+        max_workers: int,
+        rate_limiter: TokenBucket = None,
+        progress_callback: Callable[[int, int, int], None] = None,
+    ) -> List[str]:
+        """Genera narraciones con peticiones solo de texto, una por diapositiva."""
+        tasks = [
+            partial(self._request_with_retry, [], self._text_prompt(prompt_user, content), max_tokens, rate_limiter)
+            for content in contents
+        ]
+        return self._run_concurrently(tasks, max_workers, progress_callback)
+
+    def _payload_size(self, image_obj: Any):
+        """
+        Bytes de la imagen que se habría enviado si se conocen sin codificarla
+        (payload ya memorizado en la RawSlide o binario original); None si no.
+        """
+        if self.optimize_images:
+            payload = cached_payload(image_obj, self.vision_max_side, self.payload_max_bytes, self.payload_format)
+        elif isinstance(image_obj, RawSlide):
+            payload = image_obj.cached_bytes("PNG")
+        else:
+            payload = slide_to_bytes(image_obj)
+        return len(payload) if payload is not None else None
+
+    def _unsent_payload_bytes(self, images: List[Any]) -> int:
+        """
+        Bytes de imagen que no se enviaron para `images`, solo para el informe:
+        los ya conocidos y, para el resto, la media de los enviados por este
+        cliente (0 si aún no envió ninguno). No codifica ninguna imagen.
+        """
+        sizes = [self._payload_size(image_obj) for image_obj in images]
+        with self._stats_lock:
+            sent = self.payload_stats["images"]
+            average = self.payload_stats["payload_bytes"] / sent if sent else 0
+        return round(sum(average if size is None else size for size in sizes))
+
+    def tier_report(self) -> Dict[str, Any]:
+        """
+        Resumen de la última generación por niveles: diapositivas y tiempo de
+        cada nivel, bytes de imagen que no se enviaron (estimados con la media
+        de los enviados si no estaban ya codificados) y tiempo ahorrado
+        estimado con la latencia media de las peticiones con imagen (None si
+        no hubo ninguna con la que comparar).
+        """
+        report = dict(self.tier_stats)
+        text_slides, image_slides = report["text_slides"], report["image_slides"]
+        report["saved_seconds"] = None
+        if text_slides and image_slides:
+            image_avg = report["image_seconds"] / image_slides
+            text_avg = report["text_seconds"] / text_slides
+            report["saved_seconds"] = max(0.0, (image_avg - text_avg) * text_slides)
+        return report
+
+    def _batch_prompt(self, prompt_user: str, numbers: List[int], texts: List[str], summary: str) -> str:
+        lines = [
+            f"You will receive {len(numbers)} consecutive slides of the same presentation, "
+            f"in order: slides {numbers[0]} to {numbers[-1]}."
+        ]
+        if summary:
+            lines.append(f"Summary of the previous slides: {summary}")
+        for number, text in zip(numbers, texts):
+            if text:
+                lines.append(f"Text on slide {number}: {text}")
+        lines.append(f"For each slide, follow these instructions: {prompt_user}")
+        lines.append(
+            'Answer only with a JSON object of the form {"narrations": [{"slide": <number>, "narration": "<text>"}, ...], '
+            '"summary": "<short summary of the presentation up to the last slide>"} with one narration per slide.'
+        )
+        return "\n\n".join(lines)
+
+    def _generate_batched(
+        self,
+        slides: List[Dict[str, Any]],
+        images: List[Any],
+        prompt_user: str,
+        max_tokens: int,
+        slides_per_request: int,
+        max_workers: int,
+        rate_limiter: TokenBucket = None,
+        progress_callback: Callable[[int, int, int], None] = None,
+    ) -> List[str]:
+        """
+        Genera las narraciones enviando `slides_per_request` diapositivas por
+        petición y pidiendo una respuesta JSON por diapositiva más un resumen,
+        que se pasa como contexto al lote siguiente (por eso los lotes van en
+        orden). Las diapositivas que falten en una respuesta, o todo el lote si
+        no se puede interpretar, se generan con peticiones individuales.
+        """
+        narratives = [""] * len(images)
+        summary = ""
+        done = 0
+        for start in range(0, len(images), slides_per_request):
+            indices = list(range(start, min(start + slides_per_request, len(images))))
+            numbers = [
+                (slides[idx] or {}).get("slide_num", idx + 1) if idx < len(slides) else idx + 1
+                for idx in indices
+            ]
+            texts = [(slides[idx] or {}).get("content", "") if idx < len(slides) else "" for idx in indices]
+            prompt = self._batch_prompt(prompt_user, numbers, texts, summary)
+
+            parsed, batch_summary = {}, ""
+            try:
+                parsed, batch_summary = self._request_with_retry(
+                    [images[idx] for idx in indices],
+                    prompt,
+                    max_tokens * len(indices) + BATCH_SUMMARY_TOKENS,
+                    rate_limiter,
+                    BATCH_SYSTEM_INSTRUCTION,
+                    json_output=True,
+                    parse=lambda text: _parse_batch_response(text, numbers),
+                )
+            except Exception as e:
+                self.logger.warning(
+                    f"Batch of slides {numbers[0]}-{numbers[-1]} failed, falling back to single-slide requests: {str(e)}"
+                )
+
+            missing = [idx for idx, number in zip(indices, numbers) if number not in parsed]
+            fallback = self._generate_concurrently(
+                [images[idx] for idx in missing], prompt_user, max_tokens, max_workers, rate_limiter
+            )
+            for idx, narration in zip(missing, fallback):
+                narratives[idx] = narration
+            for idx, number in zip(indices, numbers):
+                if number in parsed:
+                    narratives[idx] = parsed[number]
+
+            if batch_summary:
+                summary = batch_summary
+            else:
+                # Sin resumen del modelo se arrastra el final de las últimas narraciones
+                summary = " ".join([summary] + [narratives[idx] for idx in indices]).strip()[-BATCH_SUMMARY_MAX_CHARS:]
+
+            if progress_callback:
+                for idx in indices:
+                    done += 1
+                    progress_callback(done, len(images), idx)
+        return narratives
+
+    def _generate_narratives(
+        self,
+        slides: List[Dict[str, Any]],
+        images: List[Any],
+        prompt_user: str,
+        max_tokens: int,
+        max_workers: int,
+        slides_per_request: int,
+        rate_limiter: TokenBucket = None,
+        progress_callback: Callable[[int, int, int], None] = None,
+        text_threshold: float = None,
+    ) -> List[str]:
+        """
+        Genera las narraciones de la presentación. Con `text_threshold`, las
+        diapositivas cuya capa de texto (`slides`: `content` y `text_coverage`)
+        alcanza esa cobertura se describen con una petición solo de texto; el
+        resto va por imagen, en peticiones por diapositiva o por lotes.
+        """
+        slides = slides or []
+        text_indices = []
+        if text_threshold is not None:
+            for idx, slide in enumerate(slides[:len(images)]):
+                slide = slide or {}
+                content = (slide.get("content") or "").strip()
+                if slide.get("text_coverage", 0.0) >= text_threshold and len(content) >= TEXT_ONLY_MIN_CHARS:
+                    text_indices.append(idx)
+        text_set = set(text_indices)
+        image_indices = [idx for idx in range(len(images)) if idx not in text_set]
+
+        narratives = [""] * len(images)
+        completed = [0]
+
+        def tier_progress(indices):
+            # Traduce el progreso de un nivel (índices locales) al de la presentación
+            if not progress_callback:
+                return None
+
+            def callback(done, total, local_idx):
+                completed[0] += 1
+                progress_callback(completed[0], len(images), indices[local_idx])
+            return callback
+
+        start = time.perf_counter()
+        text_narratives = self._generate_from_text(
+            [slides[idx]["content"] for idx in text_indices], prompt_user, max_tokens,
+            max_workers, rate_limiter, tier_progress(text_indices)
+        )
+        text_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        image_subset = [images[idx] for idx in image_indices]
+        if slides_per_request and slides_per_request > 1:
+            slides_subset = [
+                dict(slides[idx] or {}, slide_num=idx + 1) if idx < len(slides) else {"slide_num": idx + 1}
+                for idx in image_indices
+            ]
+            image_narratives = self._generate_batched(
+                slides_subset, image_subset, prompt_user, max_tokens, slides_per_request,
+                max_workers, rate_limiter, tier_progress(image_indices)
+            )
+        else:
+            image_narratives = self._generate_concurrently(
+                image_subset, prompt_user, max_tokens, max_workers, rate_limiter, tier_progress(image_indices)
+            )
+        image_seconds = time.perf_counter() - start
+
+        for idx, narration in zip(text_indices, text_narratives):
+            narratives[idx] = narration
+        for idx, narration in zip(image_indices, image_narratives):
+            narratives[idx] = narration
+
+        self.tier_stats = {
+            "text_slides": len(text_indices),
+            "image_slides": len(image_indices),
+            "text_seconds": text_seconds,
+            "image_seconds": image_seconds,
+            "saved_bytes": self._unsent_payload_bytes([images[idx] for idx in text_indices]),
+        }
+        return narratives
+
 
 class LLMStudioVLM(BaseVLM):
     def __init__(
-        self, base_url: str, model_identifier: str, api_key: str = "lm-studio"
+        self,
+        base_url: str,
+        model_identifier: str,
+        api_key: str = "lm-studio",
+        use_cache: bool = True,
+        optimize_images: bool = True,
     ):
-        super().__init__(base_url, model_identifier, api_key)
+        super().__init__(base_url, model_identifier, api_key, use_cache, optimize_images)
         from openai import OpenAI
 
-        self.client = OpenAI(base_url=base_url, api_key=api_key)
+        # Los reintentos los gestiona _generate_with_retry
+        self.client = OpenAI(base_url=base_url, api_key=api_key, max_retries=0)
 
-    def process_single_slide(
-        self, image_obj: Any, prompt_user: str, max_tokens: int = 1000
+    def _build_messages(self, images: List[Any], prompt_user: str, system_instruction: str) -> List[Dict[str, Any]]:
+        content = [{"type": "text", "text": prompt_user}]
+        for image_obj in images:
+            payload, mime_type = self._prepare_image(image_obj)
+            base64_image = base64.b64encode(payload).decode("utf-8")
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{mime_type};base64,{base64_image}"
+                },
+            })
+        return [
+            {
+                "role": "system",
+                "content": system_instruction,
+            },
+            {
+                "role": "user",
+                "content": content,
+            },
+        ]
+
+    def _generate_images(
+        self,
+        images: List[Any],
+        prompt_user: str,
+        max_tokens: int,
+        system_instruction: str = SYSTEM_INSTRUCTION,
+        json_output: bool = False,
     ) -> str:
-        try:
-            if hasattr(image_obj, "getvalue"):
-                image_bytes = image_obj.getvalue()
-            elif isinstance(image_obj, bytes):
-                image_bytes = image_obj
-            else:
-                with open(image_obj, "rb") as image_file:
-                    image_bytes = image_file.read()
-            base64_image = base64.b64encode(image_bytes).decode("utf-8")
-            completion = self.client.chat.completions.create(
-                model=self.model_identifier,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an AI assistant that generates narrative descriptions for presentation slides. Only answer with the explanation of the slide, nothing else.",
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt_user},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                },
-                            },
-                        ],
-                    },
-                ],
-                max_tokens=max_tokens,
-                stream=False,
-            )
-            return completion.choices[0].message.content
-        except Exception as e:
-            self.logger.error(f"Error processing slide: {str(e)}")
-            return ""
+        # No todos los modelos servidos localmente admiten response_format:
+        # el formato JSON se pide en el prompt y se valida al interpretarlo
+        completion = self.client.chat.completions.create(
+            model=self.model_identifier,
+            messages=self._build_messages(images, prompt_user, system_instruction),
+            max_tokens=max_tokens,
+            stream=False,
+        )
+        return completion.choices[0].message.content
+
+    def _stream_images(
+        self,
+        images: List[Any],
+        prompt_user: str,
+        max_tokens: int,
+        system_instruction: str = SYSTEM_INSTRUCTION,
+    ) -> Iterator[str]:
+        stream = self.client.chat.completions.create(
+            model=self.model_identifier,
+            messages=self._build_messages(images, prompt_user, system_instruction),
+            max_tokens=max_tokens,
+            stream=True,
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
     def get_narrative_from_slides(
         self,
@@ -87,22 +756,39 @@ class LLMStudioVLM(BaseVLM):
         images: List[Any],
         prompt_user: str,
         max_tokens: int = 1000,
+        max_workers: int = 4,
+        requests_per_minute: float = None,
+        tokens_per_minute: float = None,
+        progress_callback: Callable[[int, int, int], None] = None,
+        slides_per_request: int = 1,
+        text_threshold: float = None,
     ) -> List[str]:
-        narratives = []
-        for idx, image_obj in enumerate(images):
-            try:
-                narratives.append(
-                    self.process_single_slide(image_obj, prompt_user, max_tokens)
-                )
-            except Exception as e:
-                self.logger.error(f"Error processing slide {idx}: {str(e)}")
-                narratives.append("")
-        return narratives
+        # Un servidor local normalmente no tiene límites de uso: solo se acota la concurrencia
+        rate_limiter = None
+        if requests_per_minute or tokens_per_minute:
+            rate_limiter = TokenBucket(requests_per_minute, tokens_per_minute)
+        return self._generate_narratives(
+            slides, images, prompt_user, max_tokens, max_workers, slides_per_request, rate_limiter, progress_callback,
+            text_threshold
+        )
 
 
 class GeminiVLM(BaseVLM):
-    def __init__(self, base_url: str, model_identifier: str, api_key: str = None):
-        super().__init__(base_url, model_identifier, api_key)
+    # Gemini cobra 258 tokens por imagen de hasta 768x768
+    image_token_estimate = 258
+    temperature = 0.1
+    # Gemini trocea las imágenes grandes en teselas de 768x768: 2x2 teselas bastan para el texto de una diapositiva
+    vision_max_side = 1536
+
+    def __init__(
+        self,
+        base_url: str,
+        model_identifier: str,
+        api_key: str = None,
+        use_cache: bool = True,
+        optimize_images: bool = True,
+    ):
+        super().__init__(base_url, model_identifier, api_key, use_cache, optimize_images)
 
         # Usar API Key si se proporciona
         if api_key:
@@ -110,36 +796,53 @@ class GeminiVLM(BaseVLM):
         else:
             self.client = genai.Client()
 
-    def process_single_slide(
-        self, image_obj: Any, prompt_user: str, max_tokens: int = 1000
-    ) -> str:
-        try:
-            from PIL import Image
-            import io
-
-            # Determinar cómo abrir la imagen
-            if isinstance(image_obj, bytes):
-                image = Image.open(io.BytesIO(image_obj))
-            elif hasattr(image_obj, "read"):
-                image = Image.open(image_obj)
-            elif isinstance(image_obj, str):
-                image = Image.open(image_obj)
-            else:
-                raise ValueError("Formato de imagen no reconocido")
-
-            response = self.client.models.generate_content(
-                model=self.model_identifier,
-                contents=[prompt_user, image],
-                config=types.GenerateContentConfig(
-                    system_instruction="You are an AI assistant that generates narrative descriptions for presentation slides. Only answer with the explanation of the slide, nothing else.",
-                    max_output_tokens=max_tokens,
-                    temperature=0.1
-                )
+    def _endpoint_identity(self) -> Any:
+        # El cliente de Gemini no usa base_url: el servidor lo determina la propia clase
+        return None
+
+    def _build_request(
+        self, images: List[Any], prompt_user: str, max_tokens: int, system_instruction: str, json_output: bool = False
+    ) -> Dict[str, Any]:
+        contents = [prompt_user]
+        for image_obj in images:
+            payload, mime_type = self._prepare_image(image_obj)
+            contents.append(types.Part.from_bytes(data=payload, mime_type=mime_type))
+        return dict(
+            model=self.model_identifier,
+            contents=contents,
+            config=types.GenerateContentConfig(
+                system_instruction=system_instruction,
+                max_output_tokens=max_tokens,
+                temperature=self.temperature,
+                response_mime_type="application/json" if json_output else None
             )
-            return response.text
-        except Exception as e:
-            self.logger.error(f"Error processing slide with Gemini: {str(e)}")
-            return ""
+        )
+
+    def _generate_images(
+        self,
+        images: List[Any],
+        prompt_user: str,
+        max_tokens: int,
+        system_instruction: str = SYSTEM_INSTRUCTION,
+        json_output: bool = False,
+    ) -> str:
+        response = self.client.models.generate_content(
+            **self._build_request(images, prompt_user, max_tokens, system_instruction, json_output)
+        )
+        return response.text
+
+    def _stream_images(
+        self,
+        images: List[Any],
+        prompt_user: str,
+        max_tokens: int,
+        system_instruction: str = SYSTEM_INSTRUCTION,
+    ) -> Iterator[str]:
+        for chunk in self.client.models.generate_content_stream(
+            **self._build_request(images, prompt_user, max_tokens, system_instruction)
+        ):
+            if chunk.text:
+                yield chunk.text
 
     def get_narrative_from_slides(
         self,
@@ -147,25 +850,34 @@ class GeminiVLM(BaseVLM):
         images: List[Any],
         prompt_user: str,
         max_tokens: int = 1000,
+        max_workers: int = 4,
+        requests_per_minute: float = 15,
+        tokens_per_minute: float = None,
+        progress_callback: Callable[[int, int, int], None] = None,
+        slides_per_request: int = 1,
+        text_threshold: float = None,
     ) -> List[str]:
-        narratives = []
-        for idx, image_obj in enumerate(images):
-            try:
-                narratives.append(
-                    self.process_single_slide(image_obj, prompt_user, max_tokens)
-                )
-            except Exception as e:
-                self.logger.error(f"Error processing slide {idx} with Gemini: {str(e)}")
-                narratives.append("")
-        return narratives
+        # Por defecto, el límite de peticiones del nivel gratuito de la API
+        rate_limiter = None
+        if requests_per_minute or tokens_per_minute:
+            rate_limiter = TokenBucket(requests_per_minute, tokens_per_minute)
+        return self._generate_narratives(
+            slides, images, prompt_user, max_tokens, max_workers, slides_per_request, rate_limiter, progress_callback,
+            text_threshold
+        )
 
 
 def get_vlm(
-    model: str, base_url: str, model_identifier: str, api_key: str = None
+    model: str,
+    base_url: str,
+    model_identifier: str,
+    api_key: str = None,
+    use_cache: bool = True,
+    optimize_images: bool = True,
 ) -> BaseVLM:
     if model == "LLMStudio":
-        return LLMStudioVLM(base_url, model_identifier, api_key or "lm-studio")
+        return LLMStudioVLM(base_url, model_identifier, api_key or "lm-studio", use_cache, optimize_images)
     elif model == "Gemini 2.0":
-        return GeminiVLM(base_url, model_identifier, api_key)
+        return GeminiVLM(base_url, model_identifier, api_key, use_cache, optimize_images)
     else:
         raise ValueError(f"Unsupported model: {model}")
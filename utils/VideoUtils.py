@@ -1,10 +1,17 @@
 from moviepy import ImageClip, AudioFileClip, concatenate_videoclips
 from moviepy.video.VideoClip import ColorClip
 import io
+import math
+import multiprocessing
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import tempfile
 from PIL import Image
 import numpy as np
 from proglog import TqdmProgressBarLogger
+from utils.CacheUtils import DiskCache, hash_content
+from utils.SlideUtils import RawSlide
 import queue
 import threading
 import streamlit as st
@@ -26,19 +33,25 @@ class StreamlitLogger(TqdmProgressBarLogger):
 def create_slide_clip(slide_image, audio_path, default_duration):
     from PIL import ImageOps
 
-    if isinstance(slide_image, bytes):
-        image = Image.open(io.BytesIO(slide_image))
+    if isinstance(slide_image, RawSlide) and slide_image.width % 2 == 0 and slide_image.height % 2 == 0:
+        # Ya rasterizada a tamaño par: se usa directamente la vista sobre las muestras, sin copias
+        image_data = slide_image.array
     else:
-        image = slide_image if isinstance(slide_image, Image.Image) else Image.fromarray(slide_image)
+        if isinstance(slide_image, RawSlide):
+            image = slide_image.to_image()
+        elif isinstance(slide_image, bytes):
+            image = Image.open(io.BytesIO(slide_image))
+        else:
+            image = slide_image if isinstance(slide_image, Image.Image) else Image.fromarray(slide_image)
 
-    # Ajustar tamaño a múltiplo de 2
-    width, height = image.size
-    new_width = width - width % 2
-    new_height = height - height % 2
-    if (width != new_width) or (height != new_height):
-        image = image.resize((new_width, new_height), Image.LANCZOS)
+        # Ajustar tamaño a múltiplo de 2
+        width, height = image.size
+        new_width = width - width % 2
+        new_height = height - height % 2
+        if (width != new_width) or (height != new_height):
+            image = image.resize((new_width, new_height), Image.LANCZOS)
 
-    image_data = np.array(image)
+        image_data = np.array(image)
 
     if audio_path:
         if isinstance(audio_path, bytes):
@@ -57,7 +70,7 @@ def create_slide_clip(slide_image, audio_path, default_duration):
 
     return clip
 
-def merge_slides_to_video(slide_images, slide_audios, default_duration, output_file, fps=30, transition_silence=0.0, progress_queue=None):
+def merge_slides_to_video(slide_images, slide_audios, default_duration, output_file, fps=30, transition_silence=0.0, progress_queue=None, engine="moviepy", workers=None):
     """
     Une diapositivas y audios en un video final.
     slide_images: lista de imágenes (rutas, arrays o binarios)
@@ -66,7 +79,14 @@ def merge_slides_to_video(slide_images, slide_audios, default_duration, output_f
     output_file: ruta donde se guardará el video final.
     transition_silence: duración en segundos del clip de silencio entre diapositivas.
     progress_callback: función que recibe kwargs con información del progreso.
+    engine: motor de renderizado, "moviepy" (composición fotograma a fotograma), "ffmpeg"
+            o "segments" (un segmento por diapositiva en paralelo).
+    workers: número de procesos para el motor "segments" (por defecto, todos los núcleos).
     """
+    if engine == "ffmpeg":
+        return merge_slides_to_video_ffmpeg(slide_images, slide_audios, default_duration, output_file, fps, transition_silence, progress_queue)
+    if engine == "segments":
+        return merge_slides_to_video_segments(slide_images, slide_audios, default_duration, output_file, fps, transition_silence, progress_queue, workers)
     try:
         clips = []
         total_slides = len(slide_images)
@@ -125,4 +145,418 @@ def merge_slides_to_video(slide_images, slide_audios, default_duration, output_f
         print("¡Uy! Ocurrió un error al unir las diapositivas:", e)
         return None
         
-    return output_file
\ No newline at end of file
+    return output_file
+
+
+# ---------------------------------------------------------------------------
+# Motor nativo de ffmpeg
+# ---------------------------------------------------------------------------
+# Las diapositivas son imágenes estáticas: en lugar de componer cada fotograma
+# en Python se le entrega a ffmpeg cada imagen una sola vez junto con su
+# duración (demuxer concat) y una única pista de audio ya montada.
+
+AUDIO_SAMPLE_RATE = 44100
+
+
+def get_ffmpeg_binary():
+    """Devuelve el ejecutable de ffmpeg que usa MoviePy (respeta FFMPEG_BINARY)."""
+    from moviepy.config import FFMPEG_BINARY
+    return FFMPEG_BINARY
+
+
+def _write_slide_image(slide_image, path):
+    """Guarda la imagen de la diapositiva en disco y devuelve su ruta."""
+    if isinstance(slide_image, str):
+        return slide_image
+    if isinstance(slide_image, bytes):
+        with open(path, "wb") as f:
+            f.write(slide_image)
+        return path
+    if isinstance(slide_image, RawSlide):
+        slide_image.to_image().save(path, format="PNG", compress_level=1)
+        return path
+    image = slide_image if isinstance(slide_image, Image.Image) else Image.fromarray(slide_image)
+    image.save(path, format="PNG", compress_level=1)
+    return path
+
+
+def _slide_size(slide_image):
+    """Tamaño (ancho, alto) de la imagen redondeado a múltiplo de 2."""
+    if isinstance(slide_image, RawSlide):
+        width, height = slide_image.size
+    elif isinstance(slide_image, bytes):
+        width, height = Image.open(io.BytesIO(slide_image)).size
+    elif isinstance(slide_image, str):
+        with Image.open(slide_image) as image:
+            width, height = image.size
+    elif isinstance(slide_image, Image.Image):
+        width, height = slide_image.size
+    else:
+        height, width = np.asarray(slide_image).shape[:2]
+    return width - width % 2, height - height % 2
+
+
+def _audio_to_path(audio, work_dir, idx):
+    """Devuelve una ruta en disco para el audio de la diapositiva (o None)."""
+    if isinstance(audio, bytes):
+        path = os.path.join(work_dir, f"audio_{idx:04d}.bin")
+        with open(path, "wb") as f:
+            f.write(audio)
+        return path
+    return audio
+
+
+def _audio_duration(audio_path):
+    """Duración en segundos de un fichero de audio."""
+    audio_clip = AudioFileClip(audio_path)
+    try:
+        return audio_clip.duration
+    finally:
+        audio_clip.close()
+
+
+def _concat_escape(path):
+    """Escapa una ruta para el fichero de lista del demuxer concat."""
+    return path.replace("'", "'\\''")
+
+
+def _run_ffmpeg(args, total_duration=None, progress_queue=None, message="", start=0.0, span=0.0):
+    """
+    Ejecuta ffmpeg y, si se indica la duración total, traduce su salida
+    `-progress` al protocolo (mensaje, porcentaje) de `progress_queue`.
+    """
+    command = [get_ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error", "-nostats", "-progress", "pipe:1"] + args
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    for line in process.stdout:
+        key, _, value = line.strip().partition("=")
+        if key == "out_time_us" and progress_queue and total_duration:
+            try:
+                done = min(int(value) / 1e6 / total_duration, 1.0)
+            except ValueError:
+                continue
+            progress_queue.put((message, start + done * span))
+    stderr = process.stderr.read()
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg terminó con código {process.returncode}: {stderr.strip()}")
+
+
+def _build_audio_track(audio_paths, durations, output_path):
+    """
+    Monta la pista de audio completa: cada audio se normaliza a estéreo 44.1 kHz
+    y se rellena con silencio hasta la duración exacta de su diapositiva.
+    """
+    inputs = []
+    filters = []
+    for idx, (audio_path, duration) in enumerate(zip(audio_paths, durations)):
+        if audio_path:
+            inputs += ["-i", audio_path]
+        else:
+            inputs += ["-f", "lavfi", "-t", f"{duration:.6f}", "-i", f"anullsrc=r={AUDIO_SAMPLE_RATE}:cl=stereo"]
+        filters.append(
+            f"[{idx}:a]aresample={AUDIO_SAMPLE_RATE},aformat=sample_fmts=fltp:channel_layouts=stereo,"
+            f"apad=whole_dur={duration:.6f},atrim=0:{duration:.6f}[a{idx}]"
+        )
+    labels = "".join(f"[a{idx}]" for idx in range(len(durations)))
+    filters.append(f"{labels}concat=n={len(durations)}:v=0:a=1[aout]")
+    _run_ffmpeg(inputs + ["-filter_complex", ";".join(filters), "-map", "[aout]", "-c:a", "pcm_s16le", output_path])
+
+
+def merge_slides_to_video_ffmpeg(slide_images, slide_audios, default_duration, output_file, fps=30, transition_silence=0.0, progress_queue=None):
+    """
+    Igual que `merge_slides_to_video` pero delegando todo el trabajo en ffmpeg.
+
+    Cada diapositiva se escribe una única vez en disco y se describe en una lista
+    del demuxer concat con su duración; el vídeo resultante es de fotogramas
+    variables (un fotograma por diapositiva), por lo que `fps` se ignora.
+    """
+    try:
+        total_slides = len(slide_images)
+        if total_slides == 0:
+            raise ValueError("No hay diapositivas que renderizar")
+
+        with tempfile.TemporaryDirectory(prefix="slides2video_") as work_dir:
+            image_paths, audio_paths, durations = [], [], []
+            for idx, (image, audio) in enumerate(zip(slide_images, slide_audios)):
+                if isinstance(audio, str) and not audio.strip():
+                    audio = None
+                image_paths.append(_write_slide_image(image, os.path.join(work_dir, f"slide_{idx:04d}.png")))
+                audio_path = _audio_to_path(audio, work_dir, idx) if audio else None
+                duration = _audio_duration(audio_path) if audio_path else default_duration
+                # El silencio de transición mantiene la diapositiva en pantalla, salvo en la última.
+                if transition_silence > 0.0 and idx < total_slides - 1:
+                    duration += transition_silence
+                audio_paths.append(audio_path)
+                durations.append(duration)
+
+                if progress_queue:
+                    progress_queue.put((f"Procesando diapositiva {idx+1} de {total_slides}...", (idx + 1) / total_slides * 30))
+
+            # Lista del demuxer concat (la última imagen se repite para que ffmpeg respete su duración)
+            list_path = os.path.join(work_dir, "slides.txt")
+            with open(list_path, "w", encoding="utf-8") as f:
+                for image_path, duration in zip(image_paths, durations):
+                    f.write(f"file '{_concat_escape(os.path.abspath(image_path))}'\n")
+                    f.write(f"duration {duration:.6f}\n")
+                f.write(f"file '{_concat_escape(os.path.abspath(image_paths[-1]))}'\n")
+
+            if progress_queue:
+                progress_queue.put(("Generando pista de audio...", 35))
+            audio_track = os.path.join(work_dir, "audio.wav")
+            _build_audio_track(audio_paths, durations, audio_track)
+
+            width, height = _slide_size(slide_images[0])
+            video_filter = (
+                f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,format=yuv420p"
+            )
+            _run_ffmpeg(
+                [
+                    "-f", "concat", "-safe", "0", "-i", list_path,
+                    "-i", audio_track,
+                    "-map", "0:v", "-map", "1:a",
+                    "-vf", video_filter,
+                    "-fps_mode", "vfr",
+                    "-c:v", "libx264", "-preset", "veryfast", "-tune", "stillimage",
+                    "-c:a", "aac", "-b:a", "192k",
+                    "-movflags", "+faststart",
+                    output_file,
+                ],
+                total_duration=sum(durations),
+                progress_queue=progress_queue,
+                message="Renderizando video con ffmpeg...",
+                start=40,
+                span=60,
+            )
+
+        if progress_queue:
+            progress_queue.put(("¡Vídeo completado!", 100))
+
+    except Exception as e:
+        print("¡Uy! Ocurrió un error al unir las diapositivas con ffmpeg:", e)
+        return None
+
+    return output_file
+
+
+# ---------------------------------------------------------------------------
+# Renderizado por segmentos en paralelo
+# ---------------------------------------------------------------------------
+# Cada diapositiva se codifica como un segmento de solo vídeo en un proceso del
+# pool, con un número exacto de fotogramas a una frecuencia interna fija.
+# Todos los segmentos comparten exactamente los mismos parámetros de códec, así
+# que se unen con copia de flujo (-c copy) sin volver a codificar. El audio no
+# va en los segmentos: se monta una única pista con las duraciones de los
+# segmentos (como en el motor ffmpeg) y se codifica una sola vez al unirlos, de
+# modo que no se acumulan rellenos ni retardos de AAC entre diapositivas.
+
+SEGMENT_ENCODER_PROFILE = {
+    # Frecuencia interna: el relleno de cada diapositiva hasta un fotograma entero es < 1/fps
+    "fps": 30,
+    "codec": "libx264",
+    "bitrate": "8M",
+    "preset": "ultrafast",
+    "pix_fmt": "yuv420p",
+}
+SEGMENT_AUDIO_BITRATE = "192k"
+# Versión del formato de los segmentos; forma parte de la clave de caché para
+# no reutilizar segmentos codificados con una versión anterior
+SEGMENT_FORMAT_VERSION = 3
+# Formato de píxel de ffmpeg según los canales de una RawSlide
+RAW_PIXEL_FORMATS = {1: "gray", 3: "rgb24", 4: "rgba"}
+
+
+# Caché de segmentos ya codificados: al editar una sola diapositiva solo se
+# vuelve a codificar esa diapositiva. Tamaño máximo configurable en MB.
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get("SLIDES2VIDEO_SEGMENT_CACHE_MB", "4096")) * 1024 * 1024
+_segment_cache = None
+
+
+def get_segment_cache():
+    """Caché de segmentos compartida por todo el proceso."""
+    global _segment_cache
+    if _segment_cache is None:
+        _segment_cache = DiskCache("segments", max_bytes=SEGMENT_CACHE_MAX_BYTES, suffix=".mp4")
+    return _segment_cache
+
+
+def _content_for_hash(source):
+    """Contenido binario de una imagen (ruta, binario, PIL o array) para la clave de caché."""
+    if source is None or isinstance(source, (bytes, np.ndarray)):
+        return source
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return f.read()
+    if isinstance(source, RawSlide):
+        return source.array
+    if isinstance(source, Image.Image):
+        return [source.mode, list(source.size), source.tobytes()]
+    return np.asarray(source)
+
+
+def segment_frames(seconds):
+    """Fotogramas del segmento: la duración redondeada hacia arriba a fotogramas enteros (al menos uno)."""
+    return max(1, math.ceil(round(seconds * SEGMENT_ENCODER_PROFILE["fps"], 6)))
+
+
+def segment_cache_key(slide_image, frames, size):
+    """Clave del segmento: contenido de la imagen, fotogramas, tamaño y perfil del codificador."""
+    return hash_content(
+        _content_for_hash(slide_image),
+        frames,
+        list(size),
+        SEGMENT_ENCODER_PROFILE,
+        SEGMENT_FORMAT_VERSION,
+    )
+
+
+def _render_slide_segment(slide_image, frames, size, threads, segment_path):
+    """
+    Codifica una diapositiva como segmento MP4 de solo vídeo con exactamente
+    `frames` fotogramas (se ejecuta en un proceso del pool). Una RawSlide se
+    entrega a ffmpeg con sus muestras crudas, sin pasar por PNG.
+    """
+    profile = SEGMENT_ENCODER_PROFILE
+    width, height = size
+    image_path = None
+    if isinstance(slide_image, RawSlide):
+        source = [
+            "-stream_loop", "-1", "-f", "rawvideo",
+            "-pix_fmt", RAW_PIXEL_FORMATS[slide_image.channels],
+            "-video_size", f"{slide_image.width}x{slide_image.height}",
+            "-framerate", str(profile["fps"]), "-i", slide_image.path,
+        ]
+    else:
+        image_path = _write_slide_image(slide_image, os.path.splitext(segment_path)[0] + ".png")
+        source = ["-loop", "1", "-framerate", str(profile["fps"]), "-i", image_path]
+    video_filter = (
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,format={profile['pix_fmt']}"
+    )
+    try:
+        _run_ffmpeg(source + [
+            "-vf", video_filter,
+            "-frames:v", str(frames),
+            "-an",
+            "-c:v", profile["codec"], "-preset", profile["preset"], "-b:v", profile["bitrate"],
+            "-threads", str(threads),
+            "-f", "mp4",
+            segment_path,
+        ])
+    finally:
+        if image_path and image_path != slide_image:
+            os.remove(image_path)
+    return segment_path
+
+
+def _mux_segments(segment_paths, audio_track, output_file, work_dir, total_duration, progress_queue):
+    """Une los segmentos con el demuxer concat y copia de flujo, y añade la pista de audio."""
+    list_path = os.path.join(work_dir, "segments.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for segment_path in segment_paths:
+            f.write(f"file '{_concat_escape(os.path.abspath(segment_path))}'\n")
+    _run_ffmpeg(
+        [
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-i", audio_track,
+            "-map", "0:v", "-map", "1:a",
+            "-c:v", "copy",
+            "-c:a", "aac", "-b:a", SEGMENT_AUDIO_BITRATE,
+            "-movflags", "+faststart",
+            output_file,
+        ],
+        total_duration=total_duration,
+        progress_queue=progress_queue,
+        message="Uniendo segmentos...",
+        start=95,
+        span=5,
+    )
+
+
+def merge_slides_to_video_segments(slide_images, slide_audios, default_duration, output_file, fps=30, transition_silence=0.0, progress_queue=None, workers=None, use_cache=True):
+    """
+    Igual que `merge_slides_to_video` pero codificando cada diapositiva como un
+    segmento independiente en un pool de `workers` procesos. Los segmentos
+    usan la frecuencia interna de `SEGMENT_ENCODER_PROFILE`, por lo que `fps`
+    se ignora.
+
+    Con `use_cache` los segmentos se guardan en una caché direccionada por
+    contenido y solo se codifican las diapositivas cuya imagen o duración cambió.
+    """
+    try:
+        total_slides = len(slide_images)
+        if total_slides == 0:
+            raise ValueError("No hay diapositivas que renderizar")
+
+        workers = max(1, min(workers or os.cpu_count() or 1, total_slides))
+        # Repartir los núcleos entre los procesos para no sobresuscribir x264
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        size = _slide_size(slide_images[0])
+
+        cache = get_segment_cache() if use_cache else None
+        hits = misses = 0
+
+        with tempfile.TemporaryDirectory(prefix="slides2video_") as work_dir:
+            segment_paths = [None] * total_slides
+            audio_paths, durations = [], []
+            pending = []
+            for idx, (image, audio) in enumerate(zip(slide_images, slide_audios)):
+                if isinstance(audio, str) and not audio.strip():
+                    audio = None
+                audio_path = _audio_to_path(audio, work_dir, idx) if audio else None
+                silence = transition_silence if idx < total_slides - 1 else 0.0
+                frames = segment_frames((_audio_duration(audio_path) if audio_path else default_duration) + silence)
+                # El audio de la diapositiva se rellena hasta la duración exacta de su segmento
+                audio_paths.append(audio_path)
+                durations.append(frames / SEGMENT_ENCODER_PROFILE["fps"])
+                key = None
+                if cache:
+                    key = segment_cache_key(image, frames, size)
+                    segment_paths[idx] = cache.lookup(key)
+                if segment_paths[idx]:
+                    hits += 1
+                    continue
+                misses += 1
+                target = cache.temp_path(key) if cache else os.path.join(work_dir, f"segment_{idx:04d}.mp4")
+                pending.append((idx, key, target, image, frames))
+
+            if progress_queue:
+                progress_queue.put((
+                    f"Codificando {len(pending)} de {total_slides} segmentos con {workers} procesos "
+                    f"(caché: {hits} aciertos, {misses} fallos)...",
+                    hits / total_slides * 85
+                ))
+
+            if pending:
+                # spawn: hacer fork del servidor de Streamlit, con hilos (y quizá torch) activos, puede bloquear a los hijos
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=min(workers, len(pending)), mp_context=context) as executor:
+                    futures = {}
+                    for idx, key, target, image, frames in pending:
+                        future = executor.submit(_render_slide_segment, image, frames, size, threads, target)
+                        futures[future] = (idx, key)
+
+                    for done, future in enumerate(as_completed(futures), hits + 1):
+                        idx, key = futures[future]
+                        path = future.result()
+                        segment_paths[idx] = cache.commit(key, path) if cache else path
+                        if progress_queue:
+                            progress_queue.put((
+                                f"Segmento {idx + 1} completado ({done} de {total_slides}, "
+                                f"caché: {hits} aciertos, {misses} fallos)...",
+                                done / total_slides * 85
+                            ))
+
+            if progress_queue:
+                progress_queue.put(("Generando pista de audio...", 90))
+            audio_track = os.path.join(work_dir, "audio.wav")
+            _build_audio_track(audio_paths, durations, audio_track)
+            _mux_segments(segment_paths, audio_track, output_file, work_dir, sum(durations), progress_queue)
+
+        if progress_queue:
+            progress_queue.put(("¡Vídeo completado!", 100))
+
+    except Exception as e:
+        print("¡Uy! Ocurrió un error al unir las diapositivas por segmentos:", e)
+        return None
+
+    return output_file